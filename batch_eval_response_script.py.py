@@ -1,304 +1,123 @@
-from utils.file_util import read_json_file, write_json_to_file, iter_file_from_dir
-import pandas as pd
+from utils.file_util import write_json_to_file, iter_json_file_from_dir
+from utils.exp_util import add_experiment_args, parse_experiment_args
+from utils.eval_util import evaluate_model_results, save_summary_csvs, score_samples, \
+    bootstrap_entry, bootstrap_rows, save_bootstrap_csvs, approximate_evaluate, approximate_summary_rows, \
+    to_csv_atomic
+from utils.result_store import ResultStore
+from utils.eval_record import EvalRecords
+import argparse
+import sys
 import os
+import pandas as pd
 from metrics.qa_metrics import QAMetric
+from metrics.multi_sample_metrics import MultiSampleQAMetric
 
 
 if __name__ == '__main__':
     # ==== Global settings ====
-    PROJECT_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-    experiment_name = '250731-fix'  # Change this to your experiment name
+    parser = add_experiment_args(argparse.ArgumentParser(description='Evaluate parsed results'))
+    parser.add_argument("--bootstrap_resamples", default=0, type=int,
+                        help="bootstrap resamples for confidence intervals and paired p-values, 0 disables them")
+    parser.add_argument("--bootstrap_alpha", default=0.05, type=float, help="1 - confidence level")
+    parser.add_argument("--bootstrap_seed", default=0, type=int, help="seed of the bootstrap resampling")
+    parser.add_argument("--approx", action="store_true",
+                        help="approximate evaluation on a stratified subsample per (reasoning, complexity) cell")
+    parser.add_argument("--approx_per_cell", default=50, type=int, help="initial samples per cell")
+    parser.add_argument("--approx_target_width", default=None, type=float,
+                        help="double the samples per cell until the overall CI is at most this wide (percentage points)")
+    parser.add_argument("--approx_alpha", default=0.05, type=float, help="1 - confidence level of the approximate CIs")
+    parser.add_argument("--approx_seed", default=0, type=int, help="seed of the stratified sampling")
+    parser.add_argument("--dedup_scores", action="store_true",
+                        help="score each distinct normalized (reference, prediction) pair once across all model files")
+    args = parse_experiment_args(parser)
+    if args.approx and args.approx_per_cell < 1:
+        parser.error('--approx_per_cell must be at least 1')
 
     # Input parsed results directory
-    PARSED_RESULTS_DIR = f'{PROJECT_ROOT_DIR}/data/experiments/{experiment_name}/parsed_results'
+    PARSED_RESULTS_DIR = args.parsed_dir
 
     # Output evaluation results directory
-    EVAL_RESULT_DIR = f'{PROJECT_ROOT_DIR}/data/experiments/{experiment_name}/evaluation_results'
+    EVAL_RESULT_DIR = args.eval_dir
 
     # Create output directory if it doesn't exist
     os.makedirs(EVAL_RESULT_DIR, exist_ok=True)
 
-    qa_metric = QAMetric()
-
-    # Get all parsed result files
-    parsed_files = []
-    for file_path in iter_file_from_dir(PARSED_RESULTS_DIR, '.jsonl'):
-        data = read_json_file(file_path)
-        input_type = data[0]['input_type']
+    qa_metric = QAMetric(cache_scores=args.dedup_scores)
+
+    if args.approx:
+        # Approximate mode: estimates with confidence intervals, nothing is written to the results store
+        approximate_summary = {'complexity': [], 'reasoning': []}
+        for file_path, data in iter_json_file_from_dir(PARSED_RESULTS_DIR, '.jsonl', args.prefetch_depth):
+            model_name = os.path.basename(file_path).split('=')[0]
+            records = EvalRecords.from_samples(data, model_name)
+            del data
+            approximate_results = approximate_evaluate(
+                records, qa_metric, args.approx_per_cell, args.approx_target_width,
+                args.approx_alpha, args.approx_seed)
+            json_output_file = f"{EVAL_RESULT_DIR}/{model_name}_{approximate_results['input_type']}_approx_evaluation.json"
+            write_json_to_file(json_output_file, approximate_results)
+            for by in approximate_summary:
+                approximate_summary[by].extend(approximate_summary_rows(approximate_results, by))
+
+        for by, level_column in [('complexity', 'layout_complexity'), ('reasoning', 'reasoning_level')]:
+            summary_df = pd.DataFrame(approximate_summary[by]).sort_values(['model_name', 'input_type', level_column])
+            summary_csv_file = f"{EVAL_RESULT_DIR}/all_models_{by}_evaluation_approx_summary.csv"
+            to_csv_atomic(summary_df, summary_csv_file)
+            print(f"Approximate {by} summary CSV saved to: {summary_csv_file}")
+        print("\nApproximate evaluation completed successfully!")
+        sys.exit(0)
+
+    multi_sample_metric = MultiSampleQAMetric()
+    result_store = ResultStore(args.results_db)
+    bootstrap_entries = {}
+    # the summaries only cover the files evaluated in this run, not every model ever stored for the experiment
+    evaluated_keys = []
+
+    # the next files are read and decoded in the background while the current one is scored
+    for file_path, data in iter_json_file_from_dir(PARSED_RESULTS_DIR, '.jsonl', args.prefetch_depth):
         model_name = os.path.basename(file_path).split('=')[0]
+        # keep only the evaluation fields, the full sample dicts are released right away
+        records = EvalRecords.from_samples(data, model_name)
+        del data
 
-        # Group data by layout_complexity_level
-        complexity_groups = {}
-        for sample in data:
-            complexity_level = sample.get('layout_complexity_level', 'Unknown')
-            if complexity_level not in complexity_groups:
-                complexity_groups[complexity_level] = []
-            complexity_groups[complexity_level].append(sample)
-
-        # Group data by reasoning_level
-        reasoning_groups = {}
-        for sample in data:
-            reasoning_level = sample.get('reasoning_level', 'Unknown')
-            if reasoning_level not in reasoning_groups:
-                reasoning_groups[reasoning_level] = []
-            reasoning_groups[reasoning_level].append(sample)
-
-        # Group data by combined reasoning and complexity level
-        combined_groups = {}
-        for sample in data:
-            reasoning_level = sample.get('reasoning_level', 'Unknown')
-            complexity_level = sample.get('layout_complexity_level', 'Unknown')
-            combined_key = f"{reasoning_level}-{complexity_level}"
-            if combined_key not in combined_groups:
-                combined_groups[combined_key] = []
-            combined_groups[combined_key].append(sample)
-
-        # Evaluate each complexity level separately
-        all_results = {}
-        for complexity_level, samples in complexity_groups.items():
-            predictions = [sample['parsed_result']
-                           ['parsed_prediction'] for sample in samples]
-            references = [sample['answer'] for sample in samples]
-
-            result = qa_metric.compute(references, predictions)
-            all_results[complexity_level] = result
-
-            print(f"Model: {model_name}, Input Type: {input_type}, Layout Complexity: {complexity_level}, "
-                  f"EM: {result['EM']}, EM_with_error_2: {result['EM_with_error_2']}, "
-                  f"EM_with_error_5: {result['EM_with_error_5']}, EM_with_error_10: {result['EM_with_error_10']}")
-
-        # Evaluate each reasoning level separately
-        reasoning_results = {}
-        for reasoning_level, samples in reasoning_groups.items():
-            predictions = [sample['parsed_result']
-                           ['parsed_prediction'] for sample in samples]
-            references = [sample['answer'] for sample in samples]
-
-            result = qa_metric.compute(references, predictions)
-            reasoning_results[reasoning_level] = result
-
-            print(f"Model: {model_name}, Input Type: {input_type}, Reasoning Level: {reasoning_level}, "
-                  f"EM: {result['EM']}, EM_with_error_2: {result['EM_with_error_2']}, "
-                  f"EM_with_error_5: {result['EM_with_error_5']}, EM_with_error_10: {result['EM_with_error_10']}")
-
-        # Evaluate each combined level separately
-        combined_results = {}
-        for combined_key, samples in combined_groups.items():
-            predictions = [sample['parsed_result']
-                           ['parsed_prediction'] for sample in samples]
-            references = [sample['answer'] for sample in samples]
-
-            result = qa_metric.compute(references, predictions)
-            combined_results[combined_key] = result
-
-            print(f"Model: {model_name}, Input Type: {input_type}, Combined Level: {combined_key}, "
-                  f"EM: {result['EM']}, EM_with_error_2: {result['EM_with_error_2']}, "
-                  f"EM_with_error_5: {result['EM_with_error_5']}, EM_with_error_10: {result['EM_with_error_10']}")
-
-        # Overall results (for comparison)
-        all_predictions = [sample['parsed_result']
-                           ['parsed_prediction'] for sample in data]
-        all_references = [sample['answer'] for sample in data]
-        overall_result = qa_metric.compute(all_references, all_predictions)
-
-        print(f"Model: {model_name}, Input Type: {input_type}, Layout Complexity: Overall, "
-              f"EM: {overall_result['EM']}, EM_with_error_2: {overall_result['EM_with_error_2']}, "
-              f"EM_with_error_5: {overall_result['EM_with_error_5']}, EM_with_error_10: {overall_result['EM_with_error_10']}")
-        print("=" * 80)
+        sample_scores = score_samples(records, qa_metric)
+        detailed_results = evaluate_model_results(records, qa_metric, multi_sample_metric, sample_scores)
+        if args.bootstrap_resamples > 0:
+            bootstrap_entries.setdefault(detailed_results['input_type'], {})[model_name] = \
+                bootstrap_entry(records, sample_scores)
 
         # Save detailed results to JSON file
-        json_output_file = f"{EVAL_RESULT_DIR}/{model_name}_{input_type}_complexity_evaluation.json"
-        detailed_results = {
-            'model_name': model_name,
-            'input_type': input_type,
-            'overall': overall_result,
-            'by_complexity': all_results,
-            'by_reasoning': reasoning_results,
-            'by_combined': combined_results,
-            'sample_counts': {
-                'complexity': {level: len(samples) for level, samples in complexity_groups.items()},
-                'reasoning': {level: len(samples) for level, samples in reasoning_groups.items()},
-                'combined': {level: len(samples) for level, samples in combined_groups.items()}
-            }
-        }
+        json_output_file = f"{EVAL_RESULT_DIR}/{model_name}_{detailed_results['input_type']}_complexity_evaluation.json"
         write_json_to_file(json_output_file, detailed_results)
-        
-        # Prepare data for CSV export
-        csv_data = []
-        
-        # Add overall results
-        csv_data.append({
-            'model_name': model_name,
-            'input_type': input_type,
-            'layout_complexity': 'Overall',
-            'sample_count': len(data),
-            'EM': overall_result['EM'],
-            'EM_with_error_2': overall_result['EM_with_error_2'],
-            'EM_with_error_5': overall_result['EM_with_error_5'],
-            'EM_with_error_10': overall_result['EM_with_error_10']
-        })
-        
-        # Add results by complexity level
-        for complexity_level, result in all_results.items():
-            csv_data.append({
-                'model_name': model_name,
-                'input_type': input_type,
-                'layout_complexity': complexity_level,
-                'sample_count': len(complexity_groups[complexity_level]),
-                'EM': result['EM'],
-                'EM_with_error_2': result['EM_with_error_2'],
-                'EM_with_error_5': result['EM_with_error_5'],
-                'EM_with_error_10': result['EM_with_error_10']
-            })
-        
-        # Save to CSV
-        # csv_output_file = f"{EVAL_RESULT_DIR}/{model_name}_{input_type}_complexity_evaluation.csv"
-        # df = pd.DataFrame(csv_data)
-        # df.to_csv(csv_output_file, index=False, sep='\t')
 
         print(f"Results saved to:")
         print(f"  JSON: {json_output_file}")
-        # print(f"  CSV: {csv_output_file}")
-        
+
+        # Upsert into the results store, the summaries are views over it
+        result_store.upsert_results(args.experiment_name, detailed_results)
+        evaluated_keys.append((model_name, detailed_results['input_type']))
+
     # Create a summary CSV with all models and input types
     print("\nCreating summary CSV...")
-    summary_data = []
-    
-    # Re-read all files to create comprehensive summary
-    for file_path in iter_file_from_dir(PARSED_RESULTS_DIR, '.jsonl'):
-        data = read_json_file(file_path)
-        input_type = data[0]['input_type']
-        model_name = os.path.basename(file_path).split('=')[0]
-        
-        # Group data by layout_complexity_level
-        complexity_groups = {}
-        for sample in data:
-            complexity_level = sample.get('layout_complexity_level', 'Unknown')
-            if complexity_level not in complexity_groups:
-                complexity_groups[complexity_level] = []
-            complexity_groups[complexity_level].append(sample)
-        
-        # Overall results
-        all_predictions = [sample['parsed_result']['parsed_prediction'] for sample in data]
-        all_references = [sample['answer'] for sample in data]
-        overall_result = qa_metric.compute(all_references, all_predictions)
-        
-        summary_data.append({
-            'model_name': model_name,
-            'input_type': input_type,
-            'layout_complexity': 'Overall',
-            'sample_count': len(data),
-            'EM': overall_result['EM'],
-            'EM_with_error_2': overall_result['EM_with_error_2'],
-            'EM_with_error_5': overall_result['EM_with_error_5'],
-            'EM_with_error_10': overall_result['EM_with_error_10']
-        })
-        
-        # Results by complexity level
-        for complexity_level, samples in complexity_groups.items():
-            predictions = [sample['parsed_result']['parsed_prediction'] for sample in samples]
-            references = [sample['answer'] for sample in samples]
-            result = qa_metric.compute(references, predictions)
-            
-            summary_data.append({
-                'model_name': model_name,
-                'input_type': input_type,
-                'layout_complexity': complexity_level,
-                'sample_count': len(samples),
-                'EM': result['EM'],
-                'EM_with_error_2': result['EM_with_error_2'],
-                'EM_with_error_5': result['EM_with_error_5'],
-                'EM_with_error_10': result['EM_with_error_10']
-            })
-    
-    # Save summary CSV for each EM metric
-    summary_df = pd.DataFrame(summary_data)
-    # Sort by model, input_type, and complexity level for better readability
-    summary_df = summary_df.sort_values(['model_name', 'input_type', 'layout_complexity'])
-    
-    # Generate separate CSV files for each EM metric
-    em_metrics = ['EM', 'EM_with_error_2', 'EM_with_error_5', 'EM_with_error_10']
-    
-    for metric in em_metrics:
-        # Create a CSV with only the specific metric
-        metric_df = summary_df[['model_name', 'input_type', 'layout_complexity', 'sample_count', metric]].copy()
-        metric_csv_file = f"{EVAL_RESULT_DIR}/all_models_complexity_evaluation_summary_{metric}.csv"
-        metric_df.to_csv(metric_csv_file, index=False, sep='\t')
-        print(f"Summary CSV for {metric} saved to: {metric_csv_file}")
-    
-    # Also save the complete summary CSV
-    summary_csv_file = f"{EVAL_RESULT_DIR}/all_models_complexity_evaluation_summary_complete.csv"
-    summary_df.to_csv(summary_csv_file, index=False, sep='\t')
-    print(f"Complete summary CSV saved to: {summary_csv_file}")
-    
+    save_summary_csvs(EVAL_RESULT_DIR, result_store.summary(args.experiment_name, by='complexity', keys=evaluated_keys), by='complexity')
+
     # Create a summary CSV with all models by reasoning level
     print("\nCreating reasoning level summary CSV...")
-    reasoning_summary_data = []
-    
-    # Re-read all files to create comprehensive summary by reasoning level
-    for file_path in iter_file_from_dir(PARSED_RESULTS_DIR, '.jsonl'):
-        data = read_json_file(file_path)
-        input_type = data[0]['input_type']
-        model_name = os.path.basename(file_path).split('=')[0]
-        
-        # Group data by reasoning_level
-        reasoning_groups = {}
-        for sample in data:
-            reasoning_level = sample.get('reasoning_level', 'Unknown')
-            if reasoning_level not in reasoning_groups:
-                reasoning_groups[reasoning_level] = []
-            reasoning_groups[reasoning_level].append(sample)
-        
-        # Overall results
-        all_predictions = [sample['parsed_result']['parsed_prediction'] for sample in data]
-        all_references = [sample['answer'] for sample in data]
-        overall_result = qa_metric.compute(all_references, all_predictions)
-        
-        reasoning_summary_data.append({
-            'model_name': model_name,
-            'input_type': input_type,
-            'reasoning_level': 'Overall',
-            'sample_count': len(data),
-            'EM': overall_result['EM'],
-            'EM_with_error_2': overall_result['EM_with_error_2'],
-            'EM_with_error_5': overall_result['EM_with_error_5'],
-            'EM_with_error_10': overall_result['EM_with_error_10']
-        })
-        
-        # Results by reasoning level
-        for reasoning_level, samples in reasoning_groups.items():
-            predictions = [sample['parsed_result']['parsed_prediction'] for sample in samples]
-            references = [sample['answer'] for sample in samples]
-            result = qa_metric.compute(references, predictions)
-            
-            reasoning_summary_data.append({
-                'model_name': model_name,
-                'input_type': input_type,
-                'reasoning_level': reasoning_level,
-                'sample_count': len(samples),
-                'EM': result['EM'],
-                'EM_with_error_2': result['EM_with_error_2'],
-                'EM_with_error_5': result['EM_with_error_5'],
-                'EM_with_error_10': result['EM_with_error_10']
-            })
-    
-    # Save reasoning level summary CSV for each EM metric
-    reasoning_summary_df = pd.DataFrame(reasoning_summary_data)
-    # Sort by model, input_type, and reasoning level for better readability
-    reasoning_summary_df = reasoning_summary_df.sort_values(['model_name', 'input_type', 'reasoning_level'])
-    
-    # Generate separate CSV files for each EM metric
-    em_metrics = ['EM', 'EM_with_error_2', 'EM_with_error_5', 'EM_with_error_10']
-    
-    for metric in em_metrics:
-        # Create a CSV with only the specific metric
-        metric_df = reasoning_summary_df[['model_name', 'input_type', 'reasoning_level', 'sample_count', metric]].copy()
-        metric_csv_file = f"{EVAL_RESULT_DIR}/all_models_reasoning_evaluation_summary_{metric}.csv"
-        metric_df.to_csv(metric_csv_file, index=False, sep='\t')
-        print(f"Reasoning level summary CSV for {metric} saved to: {metric_csv_file}")
-    
-    # Also save the complete reasoning level summary CSV
-    reasoning_summary_csv_file = f"{EVAL_RESULT_DIR}/all_models_reasoning_evaluation_summary_complete.csv"
-    reasoning_summary_df.to_csv(reasoning_summary_csv_file, index=False, sep='\t')
-    print(f"Complete reasoning level summary CSV saved to: {reasoning_summary_csv_file}")
+    save_summary_csvs(EVAL_RESULT_DIR, result_store.summary(args.experiment_name, by='reasoning', keys=evaluated_keys), by='reasoning')
+    result_store.close()
+
+    if args.bootstrap_resamples > 0:
+        print("\nComputing bootstrap confidence intervals and paired p-values...")
+        ci_rows = {'complexity': [], 'reasoning': []}
+        p_value_rows = {'complexity': [], 'reasoning': []}
+        for input_type, model_entries in bootstrap_entries.items():
+            rows = bootstrap_rows(model_entries, input_type, args.bootstrap_resamples,
+                                  args.bootstrap_alpha, args.bootstrap_seed)
+            for by in rows:
+                ci_rows[by].extend(rows[by][0])
+                p_value_rows[by].extend(rows[by][1])
+        for by in ci_rows:
+            save_bootstrap_csvs(EVAL_RESULT_DIR, ci_rows[by], p_value_rows[by], by=by)
+    if args.dedup_scores:
+        print(f"\nScored {qa_metric.num_scored} distinct of {qa_metric.num_pairs} (reference, prediction) pairs")
     print("\nEvaluation completed successfully!")
@@ -1,6 +1,8 @@
 import re
 import os
-from utils.file_util import read_json_file, write_json_to_file, iter_file_from_dir
+import argparse
+from utils.file_util import write_json_to_file, iter_json_file_from_dir
+from utils.exp_util import add_experiment_args, parse_experiment_args
 
 # ==== Prediction Parsers ===
 
@@ -51,22 +53,37 @@ def preprocess_prediction_by_model(prediction: str, model_name: str) -> str:
     return prediction
 
 
+def get_predictions(sample) -> list:
+    """All generations of a sample: `prediction` may be a string or, like vllm_infer.py's
+    `raw_generation`, a list of sample_n texts."""
+    prediction = sample['prediction'] if 'prediction' in sample else sample['raw_generation']
+    if isinstance(prediction, str):
+        return [prediction]
+    return list(prediction)
+
+
 def parse_inference_results(inference_results):
     # === Start parsing ===
     parsed_results = []
     for sample in inference_results:
-        prediction = sample['prediction']
+        predictions = get_predictions(sample)
 
         # 获取模型名称（从文件名或sample中提取）
         model_name = sample.get('model_name', '')
 
-        # 模型专门的预处理
-        prediction = preprocess_prediction_by_model(prediction, model_name)
+        parsed_predictions = []
+        for prediction in predictions:
+            # 模型专门的预处理
+            prediction = preprocess_prediction_by_model(prediction, model_name)
 
-        # For all instruction types, use direct prediction parsing
-        parsed_prediction = parse_dp_prediction(prediction, model_name)
+            # For all instruction types, use direct prediction parsing
+            parsed_predictions.append(parse_dp_prediction(prediction, model_name))
+        parsed_prediction = parsed_predictions[0] if parsed_predictions else ''
 
         parsed_result = {'parsed_prediction': parsed_prediction}
+        # Keep every generation when sampling n > 1, scored by MultiSampleQAMetric
+        if len(parsed_predictions) > 1:
+            parsed_result['parsed_predictions'] = parsed_predictions
 
         # Process successful parsing ratio
         if parsed_prediction == '':
@@ -80,29 +97,36 @@ def parse_inference_results(inference_results):
     return parsed_results
 
 
+def prepare_inference_results(inference_results, model_name):
+    """Normalize a loaded inference file to a list and tag every sample with the model name."""
+    if not isinstance(inference_results, list):
+        inference_results = [inference_results]
+
+    # 为每个sample添加模型名称信息
+    for sample in inference_results:
+        sample['model_name'] = model_name
+    return inference_results
+
+
 if __name__ == '__main__':
     # ==== Global settings ====
-    PROJECT_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-    EXP_DIR = 'data/experiments/250731-fix'
+    parser = add_experiment_args(argparse.ArgumentParser(description='Parse inference results'))
+    args = parse_experiment_args(parser)
 
-    INFERENCE_RESULT_DIR = f'{PROJECT_ROOT_DIR}/{EXP_DIR}/inference_results'
-    PARSED_RUSULT_DIR = f'{PROJECT_ROOT_DIR}/{EXP_DIR}/parsed_results'
+    INFERENCE_RESULT_DIR = args.inference_dir
+    PARSED_RUSULT_DIR = args.parsed_dir
 
     # ==== Load inference results ====
-    for inference_result_file in iter_file_from_dir(f'{INFERENCE_RESULT_DIR}', '.jsonl'):
+    # the next files are read and decoded in the background while the current one is parsed
+    for inference_result_file, inference_results in iter_json_file_from_dir(
+            f'{INFERENCE_RESULT_DIR}', '.jsonl', args.prefetch_depth):
         print(f'Parsing {inference_result_file}')
 
         # 从文件名中提取模型名称
         model_name = os.path.basename(inference_result_file).split('=')[0]
 
         # === Load inference results ===
-        inference_results = read_json_file(inference_result_file)
-        if not isinstance(inference_results, list):
-            inference_results = [inference_results]
-
-        # 为每个sample添加模型名称信息
-        for sample in inference_results:
-            sample['model_name'] = model_name
+        inference_results = prepare_inference_results(inference_results, model_name)
 
         # === Parse inference results ===
         parsed_results = parse_inference_results(inference_results)
@@ -0,0 +1,62 @@
+import argparse
+import io
+import random
+import time
+from utils.file_util import read_json_file
+from utils.json_codec import available_codecs, get_codec, write_json_lines
+
+
+def make_records(num_records, sample_n=1, seed=0):
+    """Synthetic records shaped like the parsed results: a table prompt, sample_n generations and the parse result."""
+    rng = random.Random(seed)
+    records = []
+    for idx in range(num_records):
+        table = '\n'.join(' | '.join(f'{rng.uniform(-1e4, 1e4):.2f}' for _ in range(8)) for _ in range(30))
+        generations = [f'The table shows 销售额 per region.\nFinal Answer: {rng.randint(0, 10000)}' * 20
+                       for _ in range(sample_n)]
+        records.append({
+            'id': idx,
+            'instruction': f'Read the table and answer the question.\n{table}\nQuestion: 总和是多少?',
+            'answer': str(rng.randint(0, 10000)),
+            'input_type': 'text',
+            'reasoning_level': rng.choice(['R1', 'R2', 'R3']),
+            'layout_complexity_level': rng.choice(['L1', 'L2', 'L3']),
+            'raw_generation': generations,
+            'model_name': 'bench-model',
+            'parsed_result': {'parsed_prediction': str(rng.randint(0, 10000)), 'Parse@1': True},
+        })
+    return records
+
+
+def bench(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the json codecs on our record shapes')
+    parser.add_argument("--path", default=None, type=str, help="benchmark on a real jsonl file instead of synthetic records")
+    parser.add_argument("--num_records", default=5000, type=int, help="synthetic records")
+    parser.add_argument("--sample_n", default=1, type=int, help="generations per synthetic record")
+    parser.add_argument("--repeat", default=3, type=int, help="best of repeat runs")
+    args = parser.parse_args()
+
+    records = read_json_file(args.path, codec='json') if args.path else make_records(args.num_records, args.sample_n)
+    reference = io.StringIO()
+    write_json_lines(reference, records)
+    lines = [line.encode('utf-8') for line in reference.getvalue().splitlines()]
+    size_mb = len(reference.getvalue().encode('utf-8')) / 2 ** 20
+    print(f"{len(records)} records, {size_mb:.1f} MB")
+
+    for name in available_codecs():
+        codec = get_codec(name)
+        decode = bench(lambda: [codec.loads(line) for line in lines], args.repeat)
+        encode = bench(lambda: write_json_lines(io.StringIO(), records, codec), args.repeat)
+        out = io.StringIO()
+        write_json_lines(out, records, codec)
+        print(f"{name:8s} decode {size_mb / decode:8.1f} MB/s  encode {size_mb / encode:8.1f} MB/s  "
+              f"byte-compatible: {out.getvalue() == reference.getvalue()}")
@@ -0,0 +1,189 @@
+import atexit
+import multiprocessing as mp
+import os
+import queue
+import traceback
+from types import SimpleNamespace
+
+# Data-parallel generation: N engine replicas in worker processes, each owning its own slice
+# of GPUs. Prompts are cut into chunks on a shared queue, so a replica that finishes early
+# keeps pulling the remaining chunks; results are merged back in prompt order.
+#
+# The pool only needs an engine with a `generate(prompts, sampling_params)` method, built by
+# `engine_factory()` inside the worker, so it runs on CPU with a stub in place of vllm.LLM.
+
+
+def to_request_record(output):
+    """
+    Picklable copy of a RequestOutput with the attributes used by vllm_infer
+    (request_id, prompt, prompt_token_ids, outputs[].text / token_ids / finish_reason).
+    """
+    return SimpleNamespace(
+        request_id=getattr(output, 'request_id', None),
+        prompt=getattr(output, 'prompt', None),
+        prompt_token_ids=list(getattr(output, 'prompt_token_ids', None) or []),
+        outputs=[SimpleNamespace(text=item.text, token_ids=list(item.token_ids),
+                                 finish_reason=item.finish_reason) for item in output.outputs],
+    )
+
+
+def _replica_worker(replica_id, engine_factory, task_queue, result_queue):
+    try:
+        engine = engine_factory()
+        result_queue.put(('ready', replica_id, None))
+    except Exception:
+        result_queue.put(('error', None, f"engine replica {replica_id} failed to start:\n{traceback.format_exc()}"))
+        return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        chunk_id, prompts, sampling_params = task
+        try:
+            outputs = engine.generate(prompts, sampling_params)
+            result_queue.put(('done', chunk_id, [to_request_record(output) for output in outputs]))
+        except Exception:
+            result_queue.put(('error', chunk_id, f"engine replica {replica_id} failed:\n{traceback.format_exc()}"))
+
+
+def replica_devices(num_replicas, gpus_per_replica, visible_devices=None):
+    """
+    GPU ids of every replica, taken in order from CUDA_VISIBLE_DEVICES (or 0..n-1).
+    :return: list of comma separated device strings, one per replica
+    """
+    if visible_devices is None:
+        visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible_devices:
+        devices = [x.strip() for x in visible_devices.split(',') if x.strip()]
+    else:
+        devices = [str(x) for x in range(num_replicas * gpus_per_replica)]
+    if len(devices) < num_replicas * gpus_per_replica:
+        raise ValueError(f"{num_replicas} replicas x {gpus_per_replica} GPUs need "
+                         f"{num_replicas * gpus_per_replica} devices, only {len(devices)} visible")
+    return [','.join(devices[i * gpus_per_replica:(i + 1) * gpus_per_replica]) for i in range(num_replicas)]
+
+
+class ReplicaPool:
+    """
+    N engine replicas in spawned worker processes with the same `generate` interface as vllm.LLM.
+    Use it as a context manager (or call close): the workers are not daemons, so they would keep the
+    interpreter alive; on an exception they are terminated instead of finishing their chunks.
+    :param engine_factory: picklable callable building the engine inside a worker
+    :param num_replicas: number of worker processes
+    :param gpus_per_replica: GPUs given to each replica through CUDA_VISIBLE_DEVICES, 0 leaves it untouched
+    :param chunk_size: prompts per task; smaller chunks balance better, larger ones batch better
+    """
+
+    def __init__(self, engine_factory, num_replicas, gpus_per_replica=1, chunk_size=64, poll_interval=5.0):
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        # CUDA must not be initialized before the replicas pick their devices
+        context = mp.get_context('spawn')
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.workers = []
+        # chunk ids are (call, chunk) so results of an earlier failed call are never merged into a later one
+        self.call_id = 0
+
+        devices = replica_devices(num_replicas, gpus_per_replica) if gpus_per_replica > 0 else [None] * num_replicas
+        saved_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+        try:
+            for replica_id, replica_device in enumerate(devices):
+                # the spawned interpreter inherits the environment at start()
+                if replica_device is not None:
+                    os.environ['CUDA_VISIBLE_DEVICES'] = replica_device
+                # not a daemon: a tensor parallel engine starts its own worker processes
+                worker = context.Process(target=_replica_worker, daemon=False,
+                                         args=(replica_id, engine_factory, self.task_queue, self.result_queue))
+                worker.start()
+                self.workers.append(worker)
+        finally:
+            if saved_devices is None:
+                os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+            else:
+                os.environ['CUDA_VISIBLE_DEVICES'] = saved_devices
+
+        # registered after multiprocessing's own exit hook, so it runs first and the join there cannot hang
+        atexit.register(self.close, force=True)
+        try:
+            for _ in self.workers:
+                self._get_result()
+        except Exception:
+            self.close(force=True)
+            raise
+        print(f"{num_replicas} engine replicas ready")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(force=exc_type is not None)
+
+    def _get_result(self):
+        """Next ready / done message of the current call; raises when a replica failed or died."""
+        while True:
+            try:
+                status, key, payload = self.result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                dead = [i for i, worker in enumerate(self.workers) if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f"engine replicas {dead} exited unexpectedly")
+                continue
+            if status == 'ready':
+                return key, payload
+            if key is not None and key[0] != self.call_id:
+                continue  # left over from a failed call
+            if status == 'error':
+                raise RuntimeError(payload)
+            return key, payload
+
+    def _drain_tasks(self):
+        """Drop the chunks of a failed call that no replica has picked up yet."""
+        while True:
+            try:
+                self.task_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def generate(self, prompts, sampling_params):
+        """
+        Generate for all prompts across the replicas.
+        :param sampling_params: one SamplingParams for all prompts or a list with one per prompt
+        :return: request records in prompt order
+        """
+        self.call_id += 1
+        num_chunks = 0
+        for start in range(0, len(prompts), self.chunk_size):
+            chunk_params = sampling_params[start:start + self.chunk_size] \
+                if isinstance(sampling_params, list) else sampling_params
+            self.task_queue.put(((self.call_id, num_chunks), prompts[start:start + self.chunk_size], chunk_params))
+            num_chunks += 1
+
+        chunks = {}
+        try:
+            while len(chunks) < num_chunks:
+                (_, chunk_id), outputs = self._get_result()
+                chunks[chunk_id] = outputs
+        except BaseException:
+            self._drain_tasks()
+            raise
+        return [output for chunk_id in range(num_chunks) for output in chunks[chunk_id]]
+
+    def close(self, force=False):
+        """Stop the replicas: after their current chunk, or right away with force."""
+        if not self.workers:
+            return
+        atexit.unregister(self.close)
+        for worker in self.workers:
+            if force:
+                worker.terminate()
+            else:
+                self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        if force:
+            # the queues may hold items nobody will read, do not wait for them at exit
+            self.task_queue.cancel_join_thread()
+            self.result_queue.cancel_join_thread()
+        self.workers = []
@@ -0,0 +1,65 @@
+import numpy as np
+
+# resample weights are materialized chunk by chunk, keep each (chunk, n) count matrix around this size
+MAX_CHUNK_ELEMENTS = 2 ** 24
+
+
+def iter_bootstrap_counts(n: int, num_resamples: int, rng, max_chunk_elements: int = MAX_CHUNK_ELEMENTS):
+    """
+    Yield (chunk, n) matrices of how often each sample is drawn in a bootstrap resample.
+    One row per resample, every row sums to n.
+    """
+    chunk = max(1, min(num_resamples, max_chunk_elements // max(n, 1)))
+    for start in range(0, num_resamples, chunk):
+        b = min(chunk, num_resamples - start)
+        draws = rng.integers(0, n, size=(b, n)) + np.arange(b)[:, None] * n
+        yield np.bincount(draws.ravel(), minlength=b * n).reshape(b, n).astype(np.float32)
+
+
+def bootstrap_means(score_matrix, num_resamples: int = 1000, seed: int = 0) -> np.ndarray:
+    """
+    Bootstrap means of every row of score_matrix (M systems x N samples).
+    All rows share the same resamples, so differences between rows are paired.
+    :return: (num_resamples, M) resampled means
+    """
+    score_matrix = np.asarray(score_matrix, dtype=np.float32)
+    n = score_matrix.shape[1]
+    rng = np.random.default_rng(seed)
+    means = [counts @ score_matrix.T / n for counts in iter_bootstrap_counts(n, num_resamples, rng)]
+    return np.concatenate(means, axis=0)
+
+
+def bootstrap_ci(resampled_means, alpha: float = 0.05):
+    """Percentile confidence interval per system from bootstrap_means output."""
+    low, high = np.quantile(resampled_means, [alpha / 2, 1 - alpha / 2], axis=0)
+    return low, high
+
+
+def paired_bootstrap_pvalues(score_matrix, resampled_means) -> np.ndarray:
+    """
+    Two-sided paired bootstrap p-values for every pair of systems.
+    The resampled differences are centred on the observed difference (null hypothesis of no
+    difference) and p[i, j] is the fraction at least as extreme as the observed difference.
+    :return: (M, M) p-values
+    """
+    observed = np.asarray(score_matrix, dtype=np.float64).mean(axis=1)
+    observed_diff = observed[:, None] - observed[None, :]
+    resampled_diff = resampled_means[:, :, None] - resampled_means[:, None, :]
+    # float32 resampling, a tolerance keeps identical systems at p = 1
+    extreme = np.abs(resampled_diff - observed_diff) >= np.abs(observed_diff) - 1e-6
+    return extreme.mean(axis=0)
+
+
+def bootstrap_report(score_matrix, num_resamples: int = 1000, alpha: float = 0.05, seed: int = 0) -> dict:
+    """
+    Point estimates, confidence intervals and paired p-values of M systems scored on the same N samples.
+    :return: dict of mean / ci_low / ci_high (M,) and p_values (M, M)
+    """
+    resampled_means = bootstrap_means(score_matrix, num_resamples, seed)
+    low, high = bootstrap_ci(resampled_means, alpha)
+    return {
+        'mean': np.asarray(score_matrix, dtype=np.float64).mean(axis=1),
+        'ci_low': low,
+        'ci_high': high,
+        'p_values': paired_bootstrap_pvalues(score_matrix, resampled_means),
+    }
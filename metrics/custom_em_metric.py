@@ -37,10 +37,9 @@ def is_number(val: str) -> bool:
     return bool(re.match(r'^-?\d+(\.\d+)?%?$', val))
 
 
-def compute_em(references: List[str], predictions: List[str]) -> float:
-    """Evaluate overall EM values and consider inconsistencies in the number of predicted outcomes"""
-    total_score = 0.0
-    total_count = 0
+def compute_em_scores(references: List[str], predictions: List[str]) -> List[float]:
+    """Per-pair EM scores, partial credit is given per comma-separated answer"""
+    scores = []
 
     for pred, ref in zip(predictions, references):
         ref_answers = [x.strip() for x in ref.split(',')]
@@ -76,16 +75,20 @@ def compute_em(references: List[str], predictions: List[str]) -> float:
                 if r == p:
                     match_score += weight
 
-        total_score += match_score
-        total_count += 1
+        scores.append(match_score)
 
-    return total_score / total_count if total_count else 0.0
+    return scores
 
 
-def compute_em_with_tolerance(references: List[str], predictions: List[str], error_range: float) -> float:
-    """Evaluation of EM values, numerical categories within the margin of error, in percent (e.g., 5 for 5%)"""
-    total_score = 0.0
-    total_count = 0
+def compute_em(references: List[str], predictions: List[str]) -> float:
+    """Evaluate overall EM values and consider inconsistencies in the number of predicted outcomes"""
+    scores = compute_em_scores(references, predictions)
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def compute_em_with_tolerance_scores(references: List[str], predictions: List[str], error_range: float) -> List[float]:
+    """Per-pair EM scores, numerical answers within the margin of error (in percent) count as matches"""
+    scores = []
 
     for pred, ref in zip(predictions, references):
         ref_answers = [x.strip() for x in ref.split(',')]
@@ -117,7 +120,12 @@ def compute_em_with_tolerance(references: List[str], predictions: List[str], err
                 if r == p:
                     match_score += weight
 
-        total_score += match_score
-        total_count += 1
+        scores.append(match_score)
+
+    return scores
 
-    return total_score / total_count if total_count else 0.0
+
+def compute_em_with_tolerance(references: List[str], predictions: List[str], error_range: float) -> float:
+    """Evaluation of EM values, numerical categories within the margin of error, in percent (e.g., 5 for 5%)"""
+    scores = compute_em_with_tolerance_scores(references, predictions, error_range)
+    return sum(scores) / len(scores) if scores else 0.0
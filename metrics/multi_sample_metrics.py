@@ -0,0 +1,99 @@
+from collections import Counter
+from typing import List, Sequence
+
+import numpy as np
+
+from metrics.base_metric import BaseMetric
+from metrics.custom_em_metric import compute_em_scores
+from metrics.qa_metrics import QAMetric
+
+
+def estimate_pass_at_k(num_samples, num_correct, k: int) -> np.ndarray:
+    """
+    Unbiased pass@k estimator 1 - C(n-c, k) / C(n, k), vectorized over samples.
+    C(n-c, k) / C(n, k) is expanded to prod_{j<k} (n-c-j) / (n-j) to stay in floating point.
+    """
+    n = np.asarray(num_samples, dtype=np.float64)
+    c = np.asarray(num_correct, dtype=np.float64)
+    j = np.arange(k, dtype=np.float64)
+    ratio = np.clip(n[:, None] - c[:, None] - j, 0, None) / (n[:, None] - j)
+    return 1.0 - np.prod(ratio, axis=1)
+
+
+def majority_vote(predictions: Sequence[str]):
+    """Most frequent non-empty prediction (first seen wins ties) and its vote count."""
+    votes = Counter(p for p in predictions if p != '')
+    if not votes:
+        return '', 0
+    return votes.most_common(1)[0]
+
+
+class MultiSampleQAMetric(BaseMetric):
+    """
+    Metrics over n generations per question (vllm_infer.py --sample_n > 1).
+
+    All n x N (reference, prediction) pairs are normalized and scored in one call, the
+    resulting correctness matrix is then reduced to pass@k, majority-vote EM and
+    per-sample consistency without per-candidate loops.
+    """
+
+    def __init__(self, ks=(1, 2, 4, 8, 16), **kwargs):
+        self.ks = ks
+        self.qa_metric = QAMetric()
+
+    def sample_scores(self, references: List[str], predictions: List[List[str]]) -> dict:
+        '''
+        Per-sample score arrays: correct (N, n) bool, num_samples (N,), majority_em (N,), consistency (N,)
+        '''
+        num_samples = np.array([len(preds) for preds in predictions], dtype=np.int64)
+        width = int(num_samples.max()) if len(num_samples) else 0
+
+        # flatten to one batch, samples with fewer generations are padded with misses
+        flat_references = [ref for ref in references for _ in range(width)]
+        flat_predictions = [preds[i] if i < len(preds) else '' for preds in predictions for i in range(width)]
+        flat_references, flat_predictions = self.qa_metric.prepsocess(flat_references, flat_predictions)
+        scores = np.array(compute_em_scores(flat_references, flat_predictions), dtype=np.float64)
+        # partial credits of 1/len(parts) do not always sum to exactly 1.0 (e.g. 10 parts)
+        correct = scores.reshape(len(predictions), width) >= 1.0 - 1e-9
+        correct &= np.arange(width)[None, :] < num_samples[:, None]
+
+        normalized = [flat_predictions[i * width:i * width + n] for i, n in enumerate(num_samples)]
+        voted = [majority_vote(preds) for preds in normalized]
+        normalized_references, _ = self.qa_metric.prepsocess(references, references)
+        majority_em = np.array(compute_em_scores(
+            normalized_references, [answer for answer, _ in voted]), dtype=np.float64)
+        consistency = np.array([count for _, count in voted], dtype=np.float64) / np.maximum(num_samples, 1)
+
+        return {
+            'correct': correct,
+            'num_samples': num_samples,
+            'majority_em': majority_em,
+            'consistency': consistency,
+        }
+
+    def aggregate(self, sample_scores: dict, index=None) -> dict:
+        '''
+        Reduce per-sample score arrays (optionally restricted to the rows in index) to metrics
+        '''
+        if index is not None:
+            sample_scores = {key: value[index] for key, value in sample_scores.items()}
+        num_samples = sample_scores['num_samples']
+        if len(num_samples) == 0:
+            return {}
+        num_correct = sample_scores['correct'].sum(axis=1)
+
+        metric_scores = {}
+        for k in self.ks:
+            if k > num_samples.min():
+                break
+            metric_scores[f'pass@{k}'] = round(float(estimate_pass_at_k(num_samples, num_correct, k).mean()) * 100, 2)
+        metric_scores['majority_EM'] = round(float(sample_scores['majority_em'].mean()) * 100, 2)
+        metric_scores['consistency'] = round(float(sample_scores['consistency'].mean()) * 100, 2)
+        metric_scores['num_generations'] = int(num_samples.max())
+        return metric_scores
+
+    def compute(self, references, predictions):
+        '''
+        Support Metrics: pass@k, majority_EM, consistency
+        '''
+        return self.aggregate(self.sample_scores(references, predictions))
@@ -3,7 +3,7 @@ import sys
 
 from metrics.base_metric import BaseMetric
 import re
-from metrics.custom_em_metric import compute_em, compute_em_with_tolerance
+from metrics.custom_em_metric import compute_em_scores, compute_em_with_tolerance_scores
 
 sys.path.append(os.path.join(os.getcwd()))  # noqa: E402 # isort:skip
 
@@ -24,9 +24,14 @@ def normalize_answer(s):
 
 
 class QAMetric(BaseMetric):
+    SAMPLE_METRICS = ('EM', 'EM_with_error_2', 'EM_with_error_5', 'EM_with_error_10')
 
-    def __init__(self, **kwargs):
-        pass
+    def __init__(self, cache_scores=False, **kwargs):
+        # cache_scores: keep the scores of every normalized (reference, prediction) pair seen so far, so
+        # pairs repeated within a file or across the model files of an experiment are scored only once
+        self.score_cache = {} if cache_scores else None
+        self.num_pairs = 0
+        self.num_scored = 0
 
     def prepsocess(self, references, predictions):
         '''
@@ -47,28 +52,70 @@ class QAMetric(BaseMetric):
         references = processed_references
         return references, predictions
 
-    def compute(self, references, predictions):
+    def compute_sample_scores(self, references, predictions):
         '''
-        Support Mtrics: EM, ROUGE-L
+        Per-sample scores in [0, 1] for every metric, aggregate them with aggregate_sample_scores
+        '''
+        if self.score_cache is None:
+            return self.score_pairs(references, predictions)
+
+        cache = self.score_cache
+        # scores only depend on the normalized pair, so "Apple" / "apple " share one entry;
+        # answers and predictions repeat a lot, normalize each distinct string once
+        normalized = {}
+        for text in (*references, *predictions):
+            if text not in normalized:
+                normalized[text] = normalize_answer(text)
+        pairs = [(normalized[reference], normalized[prediction])
+                 for reference, prediction in zip(references, predictions)]
+        # unique unseen pairs in first-seen order
+        missing = list(dict.fromkeys(pair for pair in pairs if pair not in cache))
+        if missing:
+            scores = self.score_normalized([pair[0] for pair in missing], [pair[1] for pair in missing])
+            for i, pair in enumerate(missing):
+                cache[pair] = tuple(scores[metric][i] for metric in self.SAMPLE_METRICS)
+        self.num_pairs += len(pairs)
+        self.num_scored += len(missing)
+
+        rows = [cache[pair] for pair in pairs]
+        return {metric: [row[j] for row in rows] for j, metric in enumerate(self.SAMPLE_METRICS)}
+
+    def score_pairs(self, references, predictions):
+        '''
+        Score every (reference, prediction) pair, see compute_sample_scores
         '''
-        metric_scores = {}
         references, predictions = self.prepsocess(references, predictions)
+        return self.score_normalized(references, predictions)
 
+    def score_normalized(self, references, predictions):
+        '''
+        Score pairs that already went through normalize_answer
+        '''
         sys.setrecursionlimit(8735 * 2080 + 10)
-        # calculate F1,EM, ROUGE-L, SacreBLEU, Meteor
-        em_score = compute_em(references=references, predictions=predictions)
-        em_score_with_error_2 = compute_em_with_tolerance(
-            references=references, predictions=predictions, error_range=5)
-        em_score_with_error_5 = compute_em_with_tolerance(
-            references=references, predictions=predictions, error_range=5)
-        em_score_with_error_10 = compute_em_with_tolerance(
-            references=references, predictions=predictions, error_range=10)
-
-        metric_scores = {
-            'EM': round(em_score*100, 2),
-            'EM_with_error_2': round(em_score_with_error_2*100, 2),
-            'EM_with_error_5': round(em_score_with_error_5*100, 2),
-            'EM_with_error_10': round(em_score_with_error_10*100, 2)
+        return {
+            'EM': compute_em_scores(references=references, predictions=predictions),
+            'EM_with_error_2': compute_em_with_tolerance_scores(
+                references=references, predictions=predictions, error_range=5),
+            'EM_with_error_5': compute_em_with_tolerance_scores(
+                references=references, predictions=predictions, error_range=5),
+            'EM_with_error_10': compute_em_with_tolerance_scores(
+                references=references, predictions=predictions, error_range=10),
         }
 
+    def aggregate_sample_scores(self, sample_scores, index=None):
+        '''
+        Mean of the per-sample scores (optionally restricted to the samples in index), in percent
+        '''
+        metric_scores = {}
+        for metric, scores in sample_scores.items():
+            if index is not None:
+                scores = [scores[i] for i in index]
+            score = sum(scores) / len(scores) if scores else 0.0
+            metric_scores[metric] = round(score*100, 2)
         return metric_scores
+
+    def compute(self, references, predictions):
+        '''
+        Support Mtrics: EM, ROUGE-L
+        '''
+        return self.aggregate_sample_scores(self.compute_sample_scores(references, predictions))
@@ -0,0 +1,40 @@
+from statistics import NormalDist
+
+import numpy as np
+
+
+def stratified_sample_order(strata, seed: int = 0) -> dict:
+    """
+    Seeded random order of the rows of every stratum; the first n rows of each order are a
+    stratified random subsample, and growing n keeps the rows already drawn.
+    :param strata: stratum label of every row
+    :return: {label: array of row indices}
+    """
+    rng = np.random.default_rng(seed)
+    strata = np.asarray(strata)
+    return {label: rng.permutation(np.flatnonzero(strata == label)) for label in sorted(set(strata.tolist()))}
+
+
+def stratified_estimate(cell_sizes, cell_scores, alpha: float = 0.05):
+    """
+    Stratified mean and normal confidence interval from per-stratum subsamples.
+    The variance uses the finite population correction, so fully sampled strata contribute none.
+    The per-stratum variance of the [0, 1] scores is at least the Agresti-Coull variance
+    p~(1 - p~), p~ = (sum + z^2 / 2) / (n + z^2): a subsample that is all 0 or all 1 (or a single
+    row) would otherwise claim an exact stratum mean and collapse the interval.
+    :param cell_sizes: population size N_h of every stratum
+    :param cell_scores: sampled scores of every stratum (n_h >= 1 each)
+    :return: (estimate, ci_low, ci_high)
+    """
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+    total = float(sum(cell_sizes))
+    estimate, variance = 0.0, 0.0
+    for size, scores in zip(cell_sizes, cell_scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        n, weight = len(scores), size / total
+        estimate += weight * scores.mean()
+        adjusted = (scores.sum() + z ** 2 / 2) / (n + z ** 2)
+        s2 = max(scores.var(ddof=1) if n > 1 else 0.0, adjusted * (1 - adjusted))
+        variance += weight ** 2 * (1 - n / size) * s2 / n
+    half_width = z * variance ** 0.5
+    return estimate, estimate - half_width, estimate + half_width
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import random
+import ssl
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+# Generation against an OpenAI-compatible /completions endpoint (vllm serve, TGI, ...), with the
+# same generate(prompts, sampling_params) as vllm.LLM so vllm_infer can use either backend.
+# Requests run on asyncio over a pool of keep-alive HTTP/1.1 connections; a semaphore bounds the
+# requests in flight, retryable failures back off exponentially, outputs come back in prompt order.
+# A request that still fails does not abort the file: its record carries the error and no outputs.
+
+RETRY_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(f"HTTP {status}: {body[:500]!r}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+async def _read_response(reader):
+    """Read one HTTP/1.x response; returns (status, headers, body, keep_alive)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by server')
+    version, status = status_line.split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' or (version == b'HTTP/1.1' and connection != 'close')
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body, keep_alive = await reader.read(), False
+    return int(status), headers, body, keep_alive
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one server, reused LIFO; the caller bounds how many are in use.
+    :param base_url: e.g. http://host:8000/v1
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.base_path = parts.path.rstrip('/')
+        self.idle = []
+
+    async def request(self, path, payload, headers, timeout):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"POST {self.base_path}{path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: keep-alive\r\n"
+                + ''.join(f"{key}: {value}\r\n" for key, value in headers.items()) + "\r\n").encode('latin-1')
+
+        while True:
+            reused = bool(self.idle)
+            reader, writer = self.idle.pop() if reused else await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl), timeout)
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status, response_headers, response, keep_alive = await asyncio.wait_for(_read_response(reader), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                # an idle connection the server already closed; try again on a fresh one
+                if reused:
+                    continue
+                raise ConnectionError(str(e)) from e
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, response_headers, response
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+def to_request_record(prompt, response):
+    """RequestOutput-shaped record of a completions response; servers only report token totals (usage)."""
+    choices = sorted(response['choices'], key=lambda x: x.get('index', 0))
+    return SimpleNamespace(
+        request_id=response.get('id'),
+        prompt=prompt,
+        prompt_token_ids=None,
+        usage=response.get('usage'),
+        outputs=[SimpleNamespace(text=choice['text'], token_ids=None, finish_reason=choice.get('finish_reason'))
+                 for choice in choices],
+    )
+
+
+def failed_request_record(prompt, error):
+    """Record of a request that failed for good: no completions, the error message instead."""
+    return SimpleNamespace(request_id=None, prompt=prompt, prompt_token_ids=None, usage=None, outputs=[],
+                           error=f'{type(error).__name__}: {error}')
+
+
+class OpenAIEngine:
+    """
+    vllm.LLM look-alike generating through an OpenAI-compatible completions endpoint.
+    :param api_base: endpoint root, e.g. http://host:8000/v1
+    :param model: model name served by the endpoint
+    :param max_concurrency: requests in flight (and open connections) at most
+    :param max_retries: retries of a request on connection errors, timeouts and 408/429/5xx
+    :param backoff: first retry delay in seconds, doubled on every retry up to max_backoff
+    """
+
+    def __init__(self, api_base, model, api_key=None, max_concurrency=64, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, timeout=600.0):
+        self.api_base = api_base
+        self.model = model
+        self.headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    async def _complete(self, pool, semaphore, prompt, params):
+        try:
+            return await self._request(pool, semaphore, prompt, params)
+        except Exception as e:
+            print(f"request failed: {e}")
+            return failed_request_record(prompt, e)
+
+    async def _request(self, pool, semaphore, prompt, params):
+        payload = {'model': self.model, 'prompt': prompt, **params}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    status, headers, body = await pool.request('/completions', payload, self.headers, self.timeout)
+                if status == 200:
+                    return to_request_record(prompt, json.loads(body))
+                error = HTTPStatusError(status, body, headers.get('retry-after'))
+                if status not in RETRY_STATUS:
+                    raise error
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+            retry_after = getattr(error, 'retry_after', None)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            print(f"retrying request in {delay:.1f}s after {error}")
+            await asyncio.sleep(delay)
+
+    async def agenerate(self, prompts, sampling_params):
+        pool = ConnectionPool(self.api_base)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        if not isinstance(sampling_params, list):
+            sampling_params = [sampling_params] * len(prompts)
+        try:
+            # gather keeps the prompt order whatever order the responses arrive in
+            return await asyncio.gather(*(self._complete(pool, semaphore, prompt, params)
+                                          for prompt, params in zip(prompts, sampling_params)))
+        finally:
+            pool.close()
+
+    def generate(self, prompts, sampling_params):
+        """
+        :param sampling_params: completions parameters (n, temperature, top_p, max_tokens) as a dict,
+            or a list with one dict per prompt
+        :return: request records in prompt order; failed requests have an `error` and no outputs
+        """
+        return asyncio.run(self.agenerate(prompts, sampling_params))
@@ -0,0 +1,107 @@
+import argparse
+import os
+from utils.file_util import write_json_to_file, iter_json_file_from_dir
+from utils.exp_util import add_experiment_args, parse_experiment_args
+from utils.eval_util import evaluate_model_results, save_summary_csvs
+from utils.result_store import ResultStore
+from utils.eval_record import EvalRecords
+from batch_parse_response_script import parse_inference_results, prepare_inference_results
+from metrics.qa_metrics import QAMetric
+from metrics.multi_sample_metrics import MultiSampleQAMetric
+
+# Fused infer -> parse -> eval in one process. Every stage is a generator of
+# (file_name, model_name, records) so a file's records go from one stage to the next in
+# memory; the intermediate jsonl files are only written when asked for.
+
+
+def infer_stage(args):
+    """Generate with vllm for every input file in args.data_path."""
+    import vllm_infer  # vllm is only needed when the pipeline starts from generation
+
+    tokenizer, model = vllm_infer.build_engine(args)
+    model_name = args.base_model.split('/')[-1]
+    # also exits when a later stage fails and the generator is closed
+    with vllm_infer.engine_context(model):
+        for filename in sorted(x for x in os.listdir(args.data_path) if x.endswith('.jsonl')):
+            print(f'Generating {filename}')
+            results, report, metrics = vllm_infer.generate_file(args, model, tokenizer, filename)
+            # same <model>=<file>.jsonl as vllm_infer.py writes
+            save_path = vllm_infer.get_save_path(args, filename)
+            file_name = os.path.basename(save_path)
+            if args.save_inference:
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                vllm_infer.save_file(save_path, results, report, metrics)
+            yield file_name, model_name, results
+
+
+def load_stage(inference_dir, prefetch_depth=2):
+    """Read existing inference results instead of generating them, prefetching the next files."""
+    for inference_result_file, inference_results in iter_json_file_from_dir(inference_dir, '.jsonl', prefetch_depth):
+        file_name = os.path.basename(inference_result_file)
+        yield file_name, file_name.split('=')[0], inference_results
+
+
+def parse_stage(items, parsed_dir=None):
+    for file_name, model_name, inference_results in items:
+        print(f'Parsing {file_name}')
+        inference_results = prepare_inference_results(inference_results, model_name)
+        parsed_results = parse_inference_results(inference_results)
+        if parsed_dir is not None:
+            write_json_to_file(os.path.join(parsed_dir, file_name), parsed_results, is_json_line=True)
+        yield file_name, model_name, parsed_results
+
+
+def eval_stage(items, eval_dir, result_store, experiment_name, dedup_scores=False):
+    """Score every file, write the per-model json files, upsert the results store and export the summary csvs."""
+    os.makedirs(eval_dir, exist_ok=True)
+    qa_metric = QAMetric(cache_scores=dedup_scores)
+    multi_sample_metric = MultiSampleQAMetric()
+    evaluated_keys = []
+
+    for file_name, model_name, parsed_results in items:
+        detailed_results = evaluate_model_results(
+            EvalRecords.from_samples(parsed_results, model_name), qa_metric, multi_sample_metric)
+        json_output_file = os.path.join(
+            eval_dir, f"{model_name}_{detailed_results['input_type']}_complexity_evaluation.json")
+        write_json_to_file(json_output_file, detailed_results)
+        result_store.upsert_results(experiment_name, detailed_results)
+        evaluated_keys.append((model_name, detailed_results['input_type']))
+
+    save_summary_csvs(eval_dir, result_store.summary(experiment_name, by='complexity', keys=evaluated_keys), by='complexity')
+    save_summary_csvs(eval_dir, result_store.summary(experiment_name, by='reasoning', keys=evaluated_keys), by='reasoning')
+    if dedup_scores:
+        print(f"Scored {qa_metric.num_scored} distinct of {qa_metric.num_pairs} (reference, prediction) pairs")
+
+
+def run(args):
+    if args.from_stage == 'infer':
+        items = infer_stage(args)
+    else:
+        items = load_stage(args.inference_dir, args.prefetch_depth)
+    items = parse_stage(items, args.parsed_dir if args.save_parsed else None)
+    result_store = ResultStore(args.results_db)
+    try:
+        eval_stage(items, args.eval_dir, result_store, args.experiment_name, args.dedup_scores)
+    finally:
+        # closes the generator chain, so the inference engine is released right away
+        items.close()
+        result_store.close()
+
+
+if __name__ == '__main__':
+    parser = add_experiment_args(argparse.ArgumentParser(description='infer -> parse -> eval in one process'))
+    parser.add_argument("--from_stage", default="parse", choices=["infer", "parse"],
+                        help="'infer' generates with vllm, 'parse' starts from existing inference results")
+    parser.add_argument("--save_inference", action="store_true", help="also write the inference results")
+    parser.add_argument("--save_parsed", action="store_true", help="also write the parsed results")
+    parser.add_argument("--dedup_scores", action="store_true",
+                        help="score each distinct normalized (reference, prediction) pair once across all model files")
+
+    known_args, _ = parser.parse_known_args()
+    if known_args.from_stage == 'infer':
+        from vllm_infer import add_infer_args
+        add_infer_args(parser)
+    args = parse_experiment_args(parser)
+
+    run(args)
+    print('Pipeline completed.')
@@ -0,0 +1,73 @@
+import functools
+import os
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from data_parallel import ReplicaPool, replica_devices
+
+
+class StubEngine:
+    """Stand-in for vllm.LLM: echoes every prompt with its sampling params and the replica's devices."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+
+    def generate(self, prompts, sampling_params):
+        time.sleep(random.random() * 0.01)
+        if self.fail_on in prompts:
+            raise ValueError(f'cannot generate for {self.fail_on}')
+        if not isinstance(sampling_params, list):
+            sampling_params = [sampling_params] * len(prompts)
+        return [SimpleNamespace(request_id=prompt, prompt=prompt, prompt_token_ids=[0] * len(prompt),
+                                outputs=[SimpleNamespace(text=f'{prompt}|{params}|{self.devices}',
+                                                         token_ids=[1, 2], finish_reason='stop')])
+                for prompt, params in zip(prompts, sampling_params)]
+
+
+def test_replica_devices():
+    assert replica_devices(2, 2, '4,5,6,7') == ['4,5', '6,7']
+    with pytest.raises(ValueError):
+        replica_devices(4, 2, '0,1')
+
+
+def test_outputs_are_merged_in_prompt_order():
+    prompts = [f'p{i}' for i in range(100)]
+    with ReplicaPool(StubEngine, num_replicas=3, gpus_per_replica=1, chunk_size=7, poll_interval=0.5) as pool:
+        outputs = pool.generate(prompts, list(range(100)))
+        texts = [output.outputs[0].text.split('|') for output in outputs]
+        assert [prompt for prompt, _, _ in texts] == prompts
+        # per-prompt params are sliced along with their chunk
+        assert [params for _, params, _ in texts] == [str(i) for i in range(100)]
+        assert {devices for _, _, devices in texts} <= {'0', '1', '2'}
+        assert outputs[0].outputs[0].token_ids == [1, 2]
+        assert len(pool.generate(prompts[:3], 'same')) == 3
+
+
+def test_failed_generate_does_not_leak_into_the_next_call():
+    engine_factory = functools.partial(StubEngine, fail_on='bad')
+    pool = ReplicaPool(engine_factory, num_replicas=2, gpus_per_replica=0, chunk_size=2, poll_interval=0.5)
+    try:
+        with pytest.raises(RuntimeError, match='cannot generate for bad'):
+            pool.generate(['a', 'b', 'bad', 'c'] + [f'x{i}' for i in range(20)], None)
+        prompts = [f'q{i}' for i in range(10)]
+        assert [output.prompt for output in pool.generate(prompts, None)] == prompts
+    finally:
+        pool.close()
+    assert not pool.workers
+
+
+def test_exception_terminates_the_replicas():
+    with pytest.raises(KeyError):
+        with ReplicaPool(StubEngine, num_replicas=2, gpus_per_replica=0, poll_interval=0.5) as pool:
+            workers = list(pool.workers)
+            raise KeyError('save failed')
+    assert not any(worker.is_alive() for worker in workers)
+
+
+def test_engine_start_failure_is_raised():
+    with pytest.raises(RuntimeError, match='failed to start'):
+        ReplicaPool(functools.partial(StubEngine, unknown=1), num_replicas=1, gpus_per_replica=0, poll_interval=0.5)
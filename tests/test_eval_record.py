@@ -0,0 +1,37 @@
+import numpy as np
+
+from utils.eval_record import EvalRecords
+from utils.eval_util import EM_METRICS, bootstrap_entry, bootstrap_rows
+
+
+def make_samples(ids, levels):
+    return [{'id': sample_id, 'answer': '1', 'input_type': 'text', 'layout_complexity_level': level,
+             'reasoning_level': 'R1', 'parsed_result': {'parsed_prediction': '1'}}
+            for sample_id, level in zip(ids, levels)]
+
+
+def test_ids_are_arrays():
+    records = EvalRecords.from_samples(make_samples([3, 1, 2], ['L1'] * 3), 'm')
+    assert records.ids.dtype == np.int64
+    records = EvalRecords.from_samples(make_samples(['b', 'a', 7], ['L1'] * 3), 'm')
+    assert records.ids.tolist() == ['b', 'a', '7']
+    records = EvalRecords.from_samples([{k: v for k, v in sample.items() if k != 'id'}
+                                        for sample in make_samples([0, 0], ['L1'] * 2)], 'm')
+    assert records.sample_ids().tolist() == [0, 1]
+
+
+def test_bootstrap_pairs_models_on_the_same_ids():
+    scores = {metric: [1.0, 0.0, 1.0, 0.0] for metric in EM_METRICS}
+    entries = {
+        'a': bootstrap_entry(EvalRecords.from_samples(make_samples([1, 2, 3, 4], ['L2', 'L1', 'L2', 'L1']), 'a'),
+                             scores),
+        # same samples in another order, the level codes are assigned in a different order too
+        'b': bootstrap_entry(EvalRecords.from_samples(make_samples([2, 1, 4, 3], ['L1', 'L2', 'L1', 'L2']), 'b'),
+                             scores),
+    }
+    ci_rows, p_value_rows = bootstrap_rows(entries, 'text', num_resamples=50)['complexity']
+    em_rows = {(row['model_name'], row['level']): row for row in ci_rows if row['metric'] == 'EM'}
+    assert [level for name, level in em_rows if name == 'a'] == ['Overall', 'L1', 'L2']
+    assert em_rows['a', 'L2']['score'] == 100.0 and em_rows['a', 'L1']['score'] == 0.0
+    assert em_rows['b', 'L1']['score'] == 100.0 and em_rows['b', 'L2']['score'] == 0.0
+    assert len([row for row in p_value_rows if row['metric'] == 'EM']) == 3
@@ -0,0 +1,20 @@
+import pytest
+
+from metrics.multi_sample_metrics import MultiSampleQAMetric
+
+
+def test_multi_part_answer_counts_as_correct():
+    # ten partial credits of 0.1 sum to 0.9999999999999999
+    reference = ','.join(str(x) for x in range(10))
+    metric = MultiSampleQAMetric(ks=(1, 2))
+    scores = metric.sample_scores([reference], [[reference, reference]])
+    assert scores['correct'].tolist() == [[True, True]]
+    assert scores['majority_em'][0] == pytest.approx(1.0)
+    assert metric.aggregate(scores)['pass@1'] == 100.0
+
+
+def test_pass_at_k_with_partial_answers():
+    metric = MultiSampleQAMetric(ks=(1, 2))
+    result = metric.compute(['1,2', '3'], [['1,2', '1,5'], ['4', '4']])
+    assert result['pass@1'] == 25.0
+    assert result['pass@2'] == 50.0
@@ -0,0 +1,110 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from openai_client import OpenAIEngine
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Minimal /v1/completions: reversed choices, optional 503s, dropped connections and missing usage."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = payload['prompt']
+        with server.lock:
+            server.connections.add(self.client_address)
+            attempts = server.attempts[prompt] = server.attempts.get(prompt, 0) + 1
+        time.sleep(random.random() * 0.01)
+
+        if prompt == 'invalid':
+            self.reply(400, b'{"error": "bad request"}')
+        elif attempts <= server.fail_first:
+            self.reply(503, b'busy')
+        else:
+            response = {'id': f'cmpl-{prompt}',
+                        'choices': [{'index': i, 'text': f'{prompt}#{i}', 'finish_reason': 'stop'}
+                                    for i in reversed(range(payload.get('n', 1)))]}
+            if server.usage:
+                response['usage'] = {'prompt_tokens': len(prompt), 'completion_tokens': 2}
+            self.reply(200, json.dumps(response).encode('utf-8'))
+        # closes the keep-alive connection without telling the client
+        self.close_connection = server.drop_connections
+
+
+@pytest.fixture
+def stub_server():
+    def start(fail_first=0, drop_connections=False, usage=True):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        server.lock = threading.Lock()
+        server.attempts, server.connections = {}, set()
+        server.fail_first, server.drop_connections, server.usage = fail_first, drop_connections, usage
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_outputs_follow_prompt_order(stub_server):
+    server, url = stub_server()
+    prompts = [f'p{i}' for i in range(50)]
+    outputs = OpenAIEngine(url, 'stub', max_concurrency=8).generate(prompts, {'n': 2, 'max_tokens': 4})
+    assert [output.prompt for output in outputs] == prompts
+    assert [item.text for item in outputs[3].outputs] == ['p3#0', 'p3#1']
+    assert outputs[3].usage == {'prompt_tokens': 2, 'completion_tokens': 2}
+    # keep-alive: far fewer connections than requests
+    assert len(server.connections) <= 8
+
+
+def test_503_is_retried(stub_server):
+    server, url = stub_server(fail_first=1)
+    outputs = OpenAIEngine(url, 'stub', max_concurrency=4, backoff=0.01).generate(['a', 'b'], {'n': 1})
+    assert [output.outputs[0].text for output in outputs] == ['a#0', 'b#0']
+    assert server.attempts == {'a': 2, 'b': 2}
+
+
+def test_reconnects_when_server_drops_idle_connection(stub_server):
+    server, url = stub_server(drop_connections=True)
+    # no retries: reopening a stale pooled connection must not count as one
+    engine = OpenAIEngine(url, 'stub', max_concurrency=1, max_retries=0)
+    prompts = [f'p{i}' for i in range(5)]
+    outputs = engine.generate(prompts, {'n': 1})
+    assert [output.outputs[0].text for output in outputs] == [f'{prompt}#0' for prompt in prompts]
+    assert all(count == 1 for count in server.attempts.values())
+
+
+def test_failed_request_does_not_abort_the_others(stub_server):
+    server, url = stub_server()
+    outputs = OpenAIEngine(url, 'stub', max_retries=1, backoff=0.01).generate(['a', 'invalid', 'b'], {'n': 1})
+    assert [len(output.outputs) for output in outputs] == [1, 0, 1]
+    assert 'HTTP 400' in outputs[1].error
+    assert server.attempts['invalid'] == 1  # 400 is not retried
+
+
+def test_missing_usage(stub_server):
+    server, url = stub_server(usage=False)
+    outputs = OpenAIEngine(url, 'stub').generate(['a'], {'n': 1})
+    assert outputs[0].usage is None
+    vllm_infer = pytest.importorskip('vllm_infer', exc_type=ImportError)
+    metrics = vllm_infer.request_metrics(outputs[0])
+    assert metrics['prompt_tokens'] == 0 and metrics['generated_tokens'] == [0]
@@ -0,0 +1,13 @@
+from metrics.qa_metrics import QAMetric
+
+
+def test_dedup_scores_normalized_pairs_once():
+    metric = QAMetric(cache_scores=True)
+    references = ['Apple', 'apple ', 'The apple', '12']
+    predictions = ['apple', 'Apple', 'apple', '12.0']
+    scores = metric.compute_sample_scores(references, predictions)
+    assert scores == QAMetric().compute_sample_scores(references, predictions)
+    # ('apple', 'apple') three times and ('12', '12.0')
+    assert (metric.num_pairs, metric.num_scored) == (4, 2)
+    metric.compute_sample_scores(['APPLE'], ['an apple'])
+    assert (metric.num_pairs, metric.num_scored) == (5, 2)
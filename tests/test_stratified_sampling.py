@@ -0,0 +1,12 @@
+from metrics.stratified_sampling import stratified_estimate
+
+
+def test_homogeneous_cells_keep_a_nonzero_interval():
+    estimate, low, high = stratified_estimate([1000, 1000], [[1.0] * 50, [0.0] * 50])
+    assert estimate == 0.5
+    assert high - low > 0.05
+
+
+def test_fully_sampled_cells_are_exact():
+    estimate, low, high = stratified_estimate([50, 50], [[1.0] * 50, [0.0, 1.0] * 25])
+    assert (low, estimate, high) == (0.75, 0.75, 0.75)
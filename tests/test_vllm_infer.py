@@ -0,0 +1,143 @@
+import functools
+import json
+from types import SimpleNamespace
+
+import vllm_infer
+from data_parallel import ReplicaPool
+
+
+class CharTokenizer:
+    """One token per character, plus a BOS token when special tokens are added."""
+
+    def __call__(self, text, add_special_tokens=True):
+        if isinstance(text, list):
+            return {'input_ids': [self(x, add_special_tokens)['input_ids'] for x in text]}
+        return {'input_ids': ([1] if add_special_tokens else []) + [ord(c) for c in text]}
+
+    def decode(self, token_ids):
+        return ''.join(chr(x) for x in token_ids)
+
+
+class FakeLLM:
+    """vllm.LLM stand-in returning RequestOutput-shaped objects: 3 tokens per completion, capped by max_tokens."""
+
+    def __init__(self, model, tensor_parallel_size, trust_remote_code, max_model_len):
+        self.max_model_len = max_model_len
+
+    def generate(self, prompts, sampling_params):
+        outputs = []
+        for prompt, params in zip(prompts, sampling_params):
+            prompt_token_ids = CharTokenizer()(prompt)['input_ids']
+            assert len(prompt_token_ids) + params.max_tokens <= self.max_model_len
+            num_tokens = min(3, params.max_tokens)
+            completions = [SimpleNamespace(text=f'answer {i} of {len(prompt)}', token_ids=list(range(num_tokens)),
+                                           finish_reason='stop' if num_tokens == 3 else 'length')
+                           for i in range(params.n)]
+            outputs.append(SimpleNamespace(request_id=prompt, prompt=prompt, prompt_token_ids=prompt_token_ids,
+                                           outputs=completions))
+        return outputs
+
+
+def make_args(data_path, **kwargs):
+    args = dict(data_path=str(data_path), base_model='stub/qwen-stub', temperature=0.0, model_max_length=120,
+                max_new_tokens=64, min_new_tokens=8, overflow_policy='skip', sample_n=2, backend='vllm',
+                tensor_parallel_size=1, data_parallel_size=1)
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+def write_data(data_path, instructions):
+    data_path.mkdir(exist_ok=True)
+    with open(data_path / 'a.jsonl', 'w') as f:
+        for idx, instruction in enumerate(instructions):
+            f.write(json.dumps({'id': idx, 'instruction': instruction, 'answer': str(idx)}) + '\n')
+
+
+def test_generate_file_through_replica_pool(tmp_path):
+    instructions = [f'question {i} ' * (1 + i % 4) for i in range(11)] + ['x' * 200]
+    write_data(tmp_path / 'data', instructions)
+    args = make_args(tmp_path / 'data')
+    engine_factory = functools.partial(vllm_infer.make_engine, 'test_vllm_infer.FakeLLM', args.base_model,
+                                       args.tensor_parallel_size, args.model_max_length)
+
+    with ReplicaPool(engine_factory, num_replicas=2, gpus_per_replica=0, chunk_size=3, poll_interval=0.5) as pool:
+        results, report, metrics = vllm_infer.generate_file(args, pool, CharTokenizer(), 'a.jsonl')
+
+    assert [x['id'] for x in results] == list(range(12))
+    assert report['num_admitted'] == 11
+    # the over-length prompt is kept as a miss
+    assert results[-1]['prompt_skipped'] and results[-1]['raw_generation'] == ['', '']
+    prompts, _ = vllm_infer.load_data(args, 'a.jsonl')
+    for item, prompt in zip(results[:-1], prompts):
+        assert not item['prompt_skipped']
+        # merged back in prompt order
+        assert item['raw_generation'] == [f'answer 0 of {len(prompt)}', f'answer 1 of {len(prompt)}']
+    assert metrics['num_requests'] == 11
+
+
+def test_metrics_sidecar_with_fake_engine(tmp_path):
+    write_data(tmp_path / 'data', ['short', 'a longer question', 'x' * 200])
+    args = make_args(tmp_path / 'data', max_new_tokens=2)
+    engine = vllm_infer.make_engine('test_vllm_infer.FakeLLM', args.base_model, 1, args.model_max_length)
+    _, _, metrics = vllm_infer.generate_file(args, engine, CharTokenizer(), 'a.jsonl')
+
+    prompts, _ = vllm_infer.load_data(args, 'a.jsonl')
+    assert metrics['filename'] == 'a.jsonl'
+    assert metrics['num_requests'] == 2
+    assert metrics['num_failed'] == 0
+    # BOS + one token per character
+    assert metrics['prompt_tokens'] == sum(len(prompt) + 1 for prompt in prompts[:2])
+    # 2 requests x sample_n 2 completions x max_new_tokens 2
+    assert metrics['generated_tokens'] == 8
+    assert metrics['finish_reasons'] == {'length': 4}
+    assert [x['generated_tokens'] for x in metrics['requests']] == [[2, 2], [2, 2]]
+    assert metrics['settings'] == {
+        'base_model': 'stub/qwen-stub', 'backend': 'vllm', 'sample_n': 2, 'temperature': 0.0, 'top_p': 0.95,
+        'max_new_tokens': 2, 'model_max_length': 120, 'tensor_parallel_size': 1, 'data_parallel_size': 1,
+    }
+    assert metrics['wall_time'] >= 0
+
+
+def test_build_file_metrics_rates():
+    outputs = [SimpleNamespace(request_id='a', prompt_token_ids=[1] * 10, outputs=[
+                   SimpleNamespace(text='', token_ids=[1] * 5, finish_reason='stop')]),
+               SimpleNamespace(request_id='b', prompt_token_ids=[1] * 30, outputs=[
+                   SimpleNamespace(text='', token_ids=[1] * 15, finish_reason='length')])]
+    metrics = vllm_infer.build_file_metrics('f.jsonl', outputs, 2.0, {'sample_n': 1})
+    assert (metrics['prompt_tokens'], metrics['generated_tokens']) == (40, 20)
+    assert metrics['finish_reasons'] == {'stop': 1, 'length': 1}
+    assert metrics['requests_per_sec'] == 1.0
+    assert metrics['generated_tokens_per_sec'] == 10.0
+    assert metrics['total_tokens_per_sec'] == 30.0
+    assert metrics['settings'] == {'sample_n': 1}
+
+
+class GrowingTokenizer(CharTokenizer):
+    """Decoding 'w' yields 'ww', so a decoded prompt re-encodes to more tokens than it was cut to."""
+
+    def decode(self, token_ids):
+        return ''.join(chr(x) * (2 if x == ord('w') else 1) for x in token_ids)
+
+
+def test_truncated_prompts_fit_after_reencoding(tmp_path):
+    write_data(tmp_path / 'data', ['w' * 300, 'ab' * 150, 'short'])
+    args = make_args(tmp_path / 'data', overflow_policy='truncate', max_new_tokens=64)
+    tokenizer = GrowingTokenizer()
+    prompts, _ = vllm_infer.load_data(args, 'a.jsonl')
+    admitted_idx, admitted, max_tokens, report = vllm_infer.admit_prompts(args, tokenizer, prompts)
+
+    assert admitted_idx == [0, 1, 2]
+    for prompt, budget in zip(admitted, max_tokens):
+        length = len(tokenizer(prompt)['input_ids'])
+        assert length <= args.model_max_length - args.min_new_tokens
+        assert budget == min(args.max_new_tokens, args.model_max_length - length)
+    assert [x['truncated_tokens'] for x in report['overflow']] == \
+        [len(tokenizer(prompt)['input_ids']) for prompt in admitted[:2]]
+
+
+def test_save_path_matches_the_experiment_layout():
+    args = SimpleNamespace(base_model='/models/Qwen2-7B/', outdir=None, inference_dir='/exp/inference_results')
+    save_path = vllm_infer.get_save_path(args, 'wtq.jsonl')
+    assert save_path == '/exp/inference_results/Qwen2-7B=wtq.jsonl'
+    # the parse / eval scripts read the model name before '='
+    assert save_path.split('/')[-1].split('=')[0] == 'Qwen2-7B'
@@ -9,6 +9,7 @@ import json
 from typing import Optional, Sequence, Union
 import tqdm
 import copy
+from utils.json_codec import get_codec
 
 
 def _make_w_io_base(f, mode: str):
@@ -50,8 +51,9 @@ def jload(f, mode="r"):
     """Load a .json file into a dictionary."""
     f = _make_r_io_base(f, mode)
     
+    loads = get_codec().loads
     jdict = []
     for item in f.readlines():
-        jdict.append(json.loads(item.strip()))
+        jdict.append(loads(item.strip()))
     f.close()
     return jdict
@@ -0,0 +1,130 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+
+
+class LevelCodes:
+    """
+    等级字符串与小整数编码之间的映射，编码按首次出现的顺序分配
+    """
+    __slots__ = ('values', '_codes')
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def id_array(ids):
+    """
+    样本id数组：全部为整数时为 int64，否则为定长字符串，不为每个样本保留一个 Python 字符串
+    """
+    if all(isinstance(x, (int, np.integer)) and not isinstance(x, bool) for x in ids):
+        return np.asarray(ids, dtype=np.int64)
+    return np.asarray([str(x) for x in ids], dtype=np.str_)
+
+
+class EvalRecords:
+    """
+    一个结果文件中评测所需字段的紧凑列式存储，代替完整的样本 dict
+    只保留答案、解析结果和（可选的）样本id数组与多次生成的解析结果；reasoning_level / layout_complexity_level
+    编码为 uint16 数组，分组以下标数组表示，组合分组由两个编码直接计算，不再为每个样本拼接字符串
+    """
+    __slots__ = ('model_name', 'input_type', 'answers', 'predictions', 'multi_predictions', 'ids',
+                 'reasoning', 'complexity', 'reasoning_levels', 'complexity_levels')
+
+    def __init__(self, model_name, input_type, answers, predictions, multi_predictions, ids,
+                 reasoning, complexity, reasoning_levels, complexity_levels):
+        self.model_name = model_name
+        self.input_type = input_type
+        self.answers = answers
+        self.predictions = predictions
+        self.multi_predictions = multi_predictions
+        self.ids = ids
+        self.reasoning = reasoning
+        self.complexity = complexity
+        self.reasoning_levels = reasoning_levels
+        self.complexity_levels = complexity_levels
+
+    @classmethod
+    def from_samples(cls, data, model_name):
+        """
+        由解析后的样本 dict 列表构建，构建后即可释放原始样本
+        :param data: 解析后的样本列表（包含 parsed_result 和 answer）
+        :param model_name: 模型名称
+        :return: EvalRecords
+        """
+        reasoning_codes, complexity_codes = LevelCodes(), LevelCodes()
+        reasoning = np.empty(len(data), dtype=np.uint16)
+        complexity = np.empty(len(data), dtype=np.uint16)
+        answers, predictions = [], []
+        # answers and parsed predictions repeat a lot (short numbers), keep one object per distinct string
+        intern = {}.setdefault
+        multi_predictions = [] if any('parsed_predictions' in sample['parsed_result'] for sample in data) else None
+        ids = [] if data and 'id' in data[0] else None
+
+        for idx, sample in enumerate(data):
+            parsed_result = sample['parsed_result']
+            answers.append(intern(sample['answer'], sample['answer']))
+            predictions.append(intern(parsed_result['parsed_prediction'], parsed_result['parsed_prediction']))
+            if multi_predictions is not None:
+                multi_predictions.append(parsed_result.get('parsed_predictions', [parsed_result['parsed_prediction']]))
+            if ids is not None:
+                ids.append(sample.get('id', idx))
+            reasoning[idx] = reasoning_codes.encode(sample.get('reasoning_level', 'Unknown'))
+            complexity[idx] = complexity_codes.encode(sample.get('layout_complexity_level', 'Unknown'))
+
+        if ids is not None:
+            ids = id_array(ids)
+        return cls(model_name, data[0]['input_type'], answers, predictions, multi_predictions, ids,
+                   reasoning, complexity, reasoning_codes.values, complexity_codes.values)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def sample_ids(self):
+        """样本id，没有 id 字段时为样本在文件中的位置"""
+        return self.ids if self.ids is not None else np.arange(len(self), dtype=np.int64)
+
+    def combined(self):
+        """组合分组 (reasoning_level, layout_complexity_level) 的编码"""
+        return self.reasoning.astype(np.int32) * len(self.complexity_levels) + self.complexity
+
+    def combined_level(self, code) -> str:
+        reasoning_code, complexity_code = divmod(int(code), len(self.complexity_levels))
+        return f"{self.reasoning_levels[reasoning_code]}-{self.complexity_levels[complexity_code]}"
+
+    def level_names(self, by):
+        """
+        每个样本的分组名称
+        :param by: 'complexity'、'reasoning' 或 'combined'
+        """
+        if by == 'combined':
+            combined = self.combined()
+            names = {code: self.combined_level(code) for code in np.unique(combined)}
+            return [names[code] for code in combined]
+        levels = np.asarray(self.reasoning_levels if by == 'reasoning' else self.complexity_levels, dtype=object)
+        return levels[self.reasoning if by == 'reasoning' else self.complexity].tolist()
+
+    def group_indices(self, by):
+        """
+        按分组返回样本下标数组，分组按首次出现的顺序
+        :param by: 'complexity'、'reasoning' 或 'combined'
+        :return: {level: np.ndarray}
+        """
+        if by == 'combined':
+            codes = self.combined()
+            uniques, first_index = np.unique(codes, return_index=True)
+            return {self.combined_level(code): np.flatnonzero(codes == code)
+                    for code in uniques[np.argsort(first_index)]}
+        codes, levels = ((self.reasoning, self.reasoning_levels) if by == 'reasoning'
+                         else (self.complexity, self.complexity_levels))
+        return {level: np.flatnonzero(codes == code) for code, level in enumerate(levels)}
@@ -0,0 +1,301 @@
+# -*- coding: UTF-8 -*-
+import os
+import numpy as np
+import pandas as pd
+from metrics.bootstrap_stats import bootstrap_means, bootstrap_ci, paired_bootstrap_pvalues
+from metrics.stratified_sampling import stratified_sample_order, stratified_estimate
+
+EM_METRICS = ['EM', 'EM_with_error_2', 'EM_with_error_5', 'EM_with_error_10']
+
+
+def format_scores(result):
+    return (f"EM: {result['EM']}, EM_with_error_2: {result['EM_with_error_2']}, "
+            f"EM_with_error_5: {result['EM_with_error_5']}, EM_with_error_10: {result['EM_with_error_10']}")
+
+
+def score_samples(records, qa_metric):
+    """
+    对每个样本打分（只打分一次，各分组与总体结果都由它聚合）
+    :param records: EvalRecords
+    :return: {metric: [per-sample score in [0, 1]]}
+    """
+    return qa_metric.compute_sample_scores(records.answers, records.predictions)
+
+
+def evaluate_model_results(records, qa_metric, multi_sample_metric=None, sample_scores=None):
+    """
+    评测一个模型在一种输入类型上的解析结果，按复杂度、推理等级及二者组合分组
+    :param records: EvalRecords，见 utils.eval_record
+    :param sample_scores: score_samples 的结果，默认在此计算
+    :return: detailed results dict，即 *_complexity_evaluation.json 的内容
+    """
+    model_name, input_type = records.model_name, records.input_type
+    if sample_scores is None:
+        sample_scores = score_samples(records, qa_metric)
+
+    complexity_groups = records.group_indices('complexity')
+    reasoning_groups = records.group_indices('reasoning')
+    combined_groups = records.group_indices('combined')
+
+    grouped_results = {}
+    for group_name, label, groups in [('by_complexity', 'Layout Complexity', complexity_groups),
+                                      ('by_reasoning', 'Reasoning Level', reasoning_groups),
+                                      ('by_combined', 'Combined Level', combined_groups)]:
+        grouped_results[group_name] = {}
+        for level, index in groups.items():
+            result = qa_metric.aggregate_sample_scores(sample_scores, index)
+            grouped_results[group_name][level] = result
+
+            print(f"Model: {model_name}, Input Type: {input_type}, {label}: {level}, {format_scores(result)}")
+
+    # Overall results (for comparison)
+    overall_result = qa_metric.aggregate_sample_scores(sample_scores)
+
+    print(f"Model: {model_name}, Input Type: {input_type}, Layout Complexity: Overall, {format_scores(overall_result)}")
+
+    # Multi-sample results (sample_n > 1): all generations are scored in one batched pass,
+    # groups are then reduced from the per-sample correctness matrix by row index
+    multi_sample_results = None
+    if multi_sample_metric is not None and records.multi_predictions is not None:
+        multi_sample_scores = multi_sample_metric.sample_scores(records.answers, records.multi_predictions)
+        multi_sample_results = {'overall': multi_sample_metric.aggregate(multi_sample_scores)}
+        for group_name, groups in [('by_complexity', complexity_groups),
+                                   ('by_reasoning', reasoning_groups),
+                                   ('by_combined', combined_groups)]:
+            multi_sample_results[group_name] = {
+                level: multi_sample_metric.aggregate(multi_sample_scores, index)
+                for level, index in groups.items()}
+
+        print(f"Model: {model_name}, Input Type: {input_type}, Multi-sample: Overall, "
+              + ", ".join(f"{key}: {value}" for key, value in multi_sample_results['overall'].items()))
+    print("=" * 80)
+
+    detailed_results = {
+        'model_name': model_name,
+        'input_type': input_type,
+        'overall': overall_result,
+        'by_complexity': grouped_results['by_complexity'],
+        'by_reasoning': grouped_results['by_reasoning'],
+        'by_combined': grouped_results['by_combined'],
+        'sample_counts': {
+            'complexity': {level: len(index) for level, index in complexity_groups.items()},
+            'reasoning': {level: len(index) for level, index in reasoning_groups.items()},
+            'combined': {level: len(index) for level, index in combined_groups.items()}
+        }
+    }
+    if multi_sample_results is not None:
+        detailed_results['multi_sample'] = multi_sample_results
+    return detailed_results
+
+
+def to_csv_atomic(df, path, sep='\t'):
+    """Write a DataFrame to a temporary file and move it into place, readers never see a partial csv."""
+    tmp_path = path + '.tmp'
+    df.to_csv(tmp_path, index=False, sep=sep)
+    os.replace(tmp_path, path)
+
+
+def bootstrap_entry(records, sample_scores):
+    """
+    一个模型做 bootstrap 所需的全部信息：样本id、分组等级编码及其名称表和每个样本的分数
+    样本没有 id 字段时使用其在文件中的位置
+    """
+    return {
+        'ids': records.sample_ids(),
+        'complexity': records.complexity,
+        'complexity_levels': records.complexity_levels,
+        'reasoning': records.reasoning,
+        'reasoning_levels': records.reasoning_levels,
+        'scores': {metric: np.asarray(sample_scores[metric], dtype=np.float32) for metric in EM_METRICS},
+    }
+
+
+def bootstrap_rows(model_entries, input_type, num_resamples=1000, alpha=0.05, seed=0):
+    """
+    对同一输入类型下的所有模型计算 bootstrap 置信区间和两两配对 p 值，覆盖汇总表中的每个分组
+    样本id集合相同的模型一起做配对 bootstrap（共享同一组重采样）
+    :param model_entries: {model_name: bootstrap_entry(...)}
+    :return: {'complexity': (ci_rows, p_value_rows), 'reasoning': (ci_rows, p_value_rows)}
+    """
+    rows = {by: ([], []) for by in ['complexity', 'reasoning']}
+
+    # models are paired on the samples they share, one pairing set per distinct id set
+    pairing_sets = {}
+    for model_name, entry in model_entries.items():
+        ids = entry['ids']
+        pairing_sets.setdefault((ids.dtype.str, np.sort(ids).tobytes()), []).append(model_name)
+
+    for model_names in pairing_sets.values():
+        model_names = sorted(model_names)
+        orders = [np.argsort(model_entries[name]['ids'], kind='stable') for name in model_names]
+        # (metrics x models, samples), rows ordered metric-major
+        score_matrix = np.stack([model_entries[name]['scores'][metric][order]
+                                 for metric in EM_METRICS for name, order in zip(model_names, orders)])
+        reference = model_entries[model_names[0]]
+        codes = {by: reference[by][orders[0]] for by in rows}
+
+        groups = [('Overall', np.arange(score_matrix.shape[1]), list(rows))]
+        for by in rows:
+            levels = reference[f'{by}_levels']
+            groups += [(levels[code], np.flatnonzero(codes[by] == code), [by])
+                       for code in sorted(range(len(levels)), key=levels.__getitem__)]
+
+        num_models = len(model_names)
+        for level, index, targets in groups:
+            sub_matrix = score_matrix[:, index]
+            resampled_means = bootstrap_means(sub_matrix, num_resamples, seed)
+            low, high = bootstrap_ci(resampled_means, alpha)
+            means = sub_matrix.astype(np.float64).mean(axis=1)
+
+            ci_rows, p_value_rows = [], []
+            for m, metric in enumerate(EM_METRICS):
+                block = slice(m * num_models, (m + 1) * num_models)
+                p_values = paired_bootstrap_pvalues(sub_matrix[block], resampled_means[:, block])
+                for i, name in enumerate(model_names):
+                    k = m * num_models + i
+                    ci_rows.append({
+                        'model_name': name, 'input_type': input_type, 'level': level,
+                        'sample_count': len(index), 'metric': metric, 'score': round(means[k] * 100, 2),
+                        'ci_low': round(float(low[k]) * 100, 2), 'ci_high': round(float(high[k]) * 100, 2),
+                    })
+                    for j in range(i + 1, num_models):
+                        p_value_rows.append({
+                            'model_a': name, 'model_b': model_names[j], 'input_type': input_type, 'level': level,
+                            'sample_count': len(index), 'metric': metric,
+                            'delta': round((means[k] - means[m * num_models + j]) * 100, 2),
+                            'p_value': round(float(p_values[i, j]), 4),
+                        })
+            for by in targets:
+                rows[by][0].extend(ci_rows)
+                rows[by][1].extend(p_value_rows)
+    return rows
+
+
+def save_bootstrap_csvs(eval_dir, ci_rows, p_value_rows, by='complexity'):
+    """
+    保存 bootstrap 置信区间与配对 p 值，分组列名与汇总表一致
+    """
+    level_column = {'complexity': 'layout_complexity', 'reasoning': 'reasoning_level'}[by]
+    for name, data in [('ci', ci_rows), ('pvalues', p_value_rows)]:
+        csv_file = os.path.join(eval_dir, f"all_models_{by}_evaluation_bootstrap_{name}.csv")
+        df = pd.DataFrame(data).rename(columns={'level': level_column})
+        to_csv_atomic(df, csv_file)
+        print(f"Bootstrap {name} CSV saved to: {csv_file}")
+
+
+def approximate_evaluate(records, qa_metric, per_cell=50, target_width=None, alpha=0.05, seed=0):
+    """
+    近似评测：在每个 (reasoning_level, layout_complexity_level) 单元格中分层随机抽样，只对样本打分，
+    给出每个指标的分层估计值及置信区间
+    指定 target_width 时每轮将每个单元格的样本数翻倍，直到总体置信区间宽度（百分点）不超过 target_width 或全部样本都已打分
+    :param records: EvalRecords
+    :param per_cell: 每个单元格的初始样本数，至少为 1
+    :param target_width: 目标置信区间宽度（百分点），默认不逐步扩大
+    :return: approximate results dict
+    """
+    if per_cell < 1:
+        # nothing would be drawn: NaN estimates, and the doubling for target_width never ends
+        raise ValueError(f'per_cell must be at least 1, got {per_cell}')
+    model_name, input_type = records.model_name, records.input_type
+    orders = stratified_sample_order(records.combined(), seed)
+    scores = {metric: np.zeros(len(records)) for metric in EM_METRICS}
+
+    def estimate_group(group_cells):
+        result = {'sample_count': int(sum(drawn[cell] for cell in group_cells)),
+                  'total_count': int(sum(len(orders[cell]) for cell in group_cells))}
+        for metric in EM_METRICS:
+            estimate, low, high = stratified_estimate(
+                [len(orders[cell]) for cell in group_cells],
+                [scores[metric][orders[cell][:drawn[cell]]] for cell in group_cells], alpha)
+            result[metric] = {'estimate': round(estimate * 100, 2),
+                              'ci_low': round(low * 100, 2), 'ci_high': round(high * 100, 2)}
+        return result
+
+    drawn = {cell: 0 for cell in orders}
+    n = per_cell
+    while True:
+        # only the rows drawn in this round are scored, earlier rows keep their scores
+        new_index = np.concatenate([order[drawn[cell]:n] for cell, order in orders.items()]).astype(int)
+        if len(new_index):
+            new_scores = qa_metric.compute_sample_scores(
+                [records.answers[i] for i in new_index], [records.predictions[i] for i in new_index])
+            for metric in EM_METRICS:
+                scores[metric][new_index] = new_scores[metric]
+        drawn = {cell: min(n, len(order)) for cell, order in orders.items()}
+
+        overall = estimate_group(list(orders))
+        width = max(overall[metric]['ci_high'] - overall[metric]['ci_low'] for metric in EM_METRICS)
+        if target_width is None or width <= target_width or overall['sample_count'] == overall['total_count']:
+            break
+        n *= 2
+
+    approximate_results = {
+        'model_name': model_name,
+        'input_type': input_type,
+        'approximate': True,
+        'alpha': alpha,
+        'overall': overall,
+        # a combined code is reasoning_code * len(complexity_levels) + complexity_code
+        'by_complexity': {level: estimate_group([c for c in orders if c % len(records.complexity_levels) == code])
+                          for code, level in enumerate(records.complexity_levels)},
+        'by_reasoning': {level: estimate_group([c for c in orders if c // len(records.complexity_levels) == code])
+                         for code, level in enumerate(records.reasoning_levels)},
+        'by_combined': {records.combined_level(cell): estimate_group([cell]) for cell in orders},
+    }
+    print(f"Model: {model_name}, Input Type: {input_type}, Approximate Overall "
+          f"({overall['sample_count']}/{overall['total_count']} samples), "
+          + ", ".join(f"{metric}: {overall[metric]['estimate']} [{overall[metric]['ci_low']}, {overall[metric]['ci_high']}]"
+                      for metric in EM_METRICS))
+    return approximate_results
+
+
+def approximate_summary_rows(approximate_results, by='complexity'):
+    """
+    将近似评测结果展开为汇总表的行（Overall + 每个分组），每个指标带置信区间
+    """
+    level_column = {'complexity': 'layout_complexity', 'reasoning': 'reasoning_level'}[by]
+    groups = [('Overall', approximate_results['overall'])] + list(approximate_results[f'by_{by}'].items())
+    rows = []
+    for level, result in groups:
+        row = {
+            'model_name': approximate_results['model_name'],
+            'input_type': approximate_results['input_type'],
+            level_column: level,
+            'sample_count': result['total_count'],
+            'sampled_count': result['sample_count'],
+        }
+        for metric in EM_METRICS:
+            row[metric] = result[metric]['estimate']
+            row[f'{metric}_ci_low'] = result[metric]['ci_low']
+            row[f'{metric}_ci_high'] = result[metric]['ci_high']
+        rows.append(row)
+    return rows
+
+
+def save_summary_csvs(eval_dir, summary_data, by='complexity'):
+    """
+    保存所有模型的汇总表：每个EM指标一个csv，另加一个完整的csv
+    :param eval_dir: 评测结果目录
+    :param summary_data: 汇总表的行，见 ResultStore.summary
+    :param by: 'complexity' 或 'reasoning'
+    :return: None
+    """
+    level_column = {'complexity': 'layout_complexity', 'reasoning': 'reasoning_level'}[by]
+    label = {'complexity': 'Summary', 'reasoning': 'Reasoning level summary'}[by]
+
+    # explicit columns: no rows (nothing evaluated successfully yet) gives header-only csvs
+    summary_df = pd.DataFrame(summary_data, columns=['model_name', 'input_type', level_column, 'sample_count'] + EM_METRICS)
+    # Sort by model, input_type, and level for better readability
+    summary_df = summary_df.sort_values(['model_name', 'input_type', level_column])
+
+    for metric in EM_METRICS:
+        # Create a CSV with only the specific metric
+        metric_df = summary_df[['model_name', 'input_type', level_column, 'sample_count', metric]].copy()
+        metric_csv_file = os.path.join(eval_dir, f"all_models_{by}_evaluation_summary_{metric}.csv")
+        to_csv_atomic(metric_df, metric_csv_file)
+        print(f"{label} CSV for {metric} saved to: {metric_csv_file}")
+
+    # Also save the complete summary CSV
+    summary_csv_file = os.path.join(eval_dir, f"all_models_{by}_evaluation_summary_complete.csv")
+    to_csv_atomic(summary_df, summary_csv_file)
+    print(f"Complete {label[0].lower() + label[1:]} CSV saved to: {summary_csv_file}")
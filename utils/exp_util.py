@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+import os
+from utils.file_util import read_json_file
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# standard sub directories of an experiment, <exp_root>/<experiment_name>/<dir>
+EXPERIMENT_SUBDIRS = ('inference_results', 'parsed_results', 'evaluation_results')
+
+
+def add_experiment_args(parser):
+    """
+    添加实验名称与目录相关的命令行参数
+    :param parser: argparse.ArgumentParser
+    :return: parser
+    """
+    parser.add_argument("--config", default=None, type=str,
+                        help="json file whose keys override the defaults of the other arguments")
+    parser.add_argument("--experiment_name", default=None, type=str,
+                        help="experiment name, derived from --inference_dir / --parsed_dir / --eval_dir when omitted")
+    parser.add_argument("--exp_root", default=f'{PROJECT_ROOT_DIR}/data/experiments', type=str,
+                        help="directory holding all experiments")
+    parser.add_argument("--inference_dir", default=None, type=str,
+                        help="inference results, defaults to <exp_root>/<experiment_name>/inference_results")
+    parser.add_argument("--parsed_dir", default=None, type=str,
+                        help="parsed results, defaults to <exp_root>/<experiment_name>/parsed_results")
+    parser.add_argument("--eval_dir", default=None, type=str,
+                        help="evaluation results, defaults to <exp_root>/<experiment_name>/evaluation_results")
+    parser.add_argument("--prefetch_depth", default=2, type=int,
+                        help="result files read and decoded in the background while the current one is processed")
+    parser.add_argument("--results_db", default=None, type=str,
+                        help="sqlite results store shared by all experiments, defaults to <exp_root>/results.db")
+    return parser
+
+
+def inference_file_name(base_model, data_file):
+    """
+    推理结果文件名 <model>=<数据文件名>.jsonl，解析与评测脚本从 '=' 之前的部分读取模型名称
+    :param base_model: 模型路径或名称，取最后一级
+    :param data_file: 输入数据文件名
+    """
+    return f"{base_model.rstrip('/').split('/')[-1]}={data_file.split('.')[0]}.jsonl"
+
+
+def experiment_dir_from_dirs(*dirs):
+    """
+    由结果目录推断实验目录：<experiment_name>/parsed_results 等标准子目录取上一级目录，否则为目录本身
+    :param dirs: 结果目录，None 表示未指定
+    :return: (实验名称, 标准子目录所在的实验目录或 None)，均未指定时为 (None, None)
+    """
+    for path in dirs:
+        if path is None:
+            continue
+        path = os.path.abspath(path)
+        if os.path.basename(path) in EXPERIMENT_SUBDIRS:
+            return os.path.basename(os.path.dirname(path)) or None, os.path.dirname(path)
+        return os.path.basename(path) or None, None
+    return None, None
+
+
+def parse_experiment_args(parser, argv=None):
+    """
+    解析命令行参数：先读取 --config 指定的json文件作为默认值，命令行参数优先，再补全未指定的实验目录
+    :param parser: 已调用过 add_experiment_args 的 parser
+    :param argv: 命令行参数列表，默认为 sys.argv[1:]
+    :return: argparse.Namespace
+    """
+    args, _ = parser.parse_known_args(argv)
+    if args.config is not None:
+        config = read_json_file(args.config)
+        if config is None:
+            raise FileNotFoundError(args.config)
+        parser.set_defaults(**config)
+    args = parser.parse_args(argv)
+
+    exp_dir = None
+    if args.experiment_name is None:
+        # never fall back to a fixed name: results of unrelated runs would be mixed in the store
+        args.experiment_name, exp_dir = experiment_dir_from_dirs(args.inference_dir, args.parsed_dir, args.eval_dir)
+        if args.experiment_name is None:
+            parser.error('--experiment_name is required unless a result directory is given')
+        print(f'Experiment name: {args.experiment_name}')
+
+    # the other result directories default to the siblings of the given one
+    exp_dir = exp_dir or os.path.join(args.exp_root, args.experiment_name)
+    if args.inference_dir is None:
+        args.inference_dir = os.path.join(exp_dir, 'inference_results')
+    if args.parsed_dir is None:
+        args.parsed_dir = os.path.join(exp_dir, 'parsed_results')
+    if args.eval_dir is None:
+        args.eval_dir = os.path.join(exp_dir, 'evaluation_results')
+    if args.results_db is None:
+        args.results_db = os.path.join(args.exp_root, 'results.db')
+    return args
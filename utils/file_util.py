@@ -3,9 +3,16 @@ import os
 import json
 import pickle
 import itertools
+import mmap
+import array
+import bisect
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
 import pandas as pd
+from utils.json_codec import get_codec, write_json_lines
 
 
 def iter_file_from_dir(folder_path, ext=''):
@@ -21,6 +28,52 @@ def iter_file_from_dir(folder_path, ext=''):
             yield file_path
 
 
+def _pop_result(pending):
+    # no reference to the future is kept, the consumer may free the result while it is processed
+    item, future = pending.popleft()
+    return item, future.result()
+
+
+def prefetch_iterator(iterator, func, depth=2):
+    """
+    在后台线程中提前对 iterator 后续的 depth 个元素执行 func（如读取并解码文件），与当前元素的处理重叠
+    最多有 depth 个已提交但未被消费的结果，内存有界
+    :param iterator: 输入的iterator对象
+    :param func: 对每个元素执行的函数
+    :param depth: 预取的数量，为0时不预取，在当前线程中顺序执行
+    :return: 按输入顺序 yield (item, func(item))
+    """
+    if depth <= 0:
+        for item in iterator:
+            yield item, func(item)
+        return
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        try:
+            for item in iterator:
+                pending.append((item, pool.submit(func, item)))
+                if len(pending) > depth:
+                    yield _pop_result(pending)
+            while pending:
+                yield _pop_result(pending)
+        finally:
+            # consumer stopped early: drop the files not started yet
+            for _, future in pending:
+                future.cancel()
+
+
+def iter_json_file_from_dir(folder_path, ext='', prefetch_depth=2):
+    """
+    从指定文件夹中依次读取指定后缀名的json文件，后台预取后续 prefetch_depth 个文件
+    :param folder_path: 文件夹的绝对路径
+    :param ext: 指定的文件后缀名
+    :param prefetch_depth: 预取的文件数量，为0时不预取
+    :return: yield (文件路径, json数据)
+    """
+    return prefetch_iterator(iter_file_from_dir(folder_path, ext), read_json_file, prefetch_depth)
+
+
 def walk_file_from_dir(folder_path, ext=''):
     """
     从指定文件夹中遍历指定后缀名的所有文件列表（包含多级子文件夹）
@@ -49,46 +102,196 @@ def iter_line_from_file(file_path, func=None):
                 yield line.strip()
 
 
-def read_json_file(path, filter_func=None):
+def _is_json_line_content(content: bytes, codec) -> bool:
+    """
+    判断文件内容是否为json_line格式：第一行本身是完整的json，且其后还有内容
+    避免先把整个json_line文件当作一个json解析（解析失败前要扫描整个文件）
+    """
+    content = content.lstrip()
+    end = content.find(b'\n')
+    if end == -1 or not content[end:].strip():
+        return False
+    try:
+        codec.loads(content[:end])
+    except ValueError:
+        return False
+    return True
+
+
+def read_json_file(path, filter_func=None, codec=None):
     """
     读取json文件
     :param path: json文件的绝对路径
-    :param is_json_line: 是否为json_line格式的文件，默认为False
     :param filter_func: 用来筛选每个json对象的lambda函数，默认为None
+    :param codec: 解码使用的codec名称，默认为已安装中最快的，见 utils.json_codec
     :return: 返回json list
     """
     if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
+        codec = get_codec(codec)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if not _is_json_line_content(content, codec):
             try:
-                json_data = json.load(f)
+                json_data = codec.loads(content)
                 if filter_func is not None:
                     json_data = list(filter(filter_func, json_data))
                 return json_data
             except Exception as e:
-                f.seek(0)
-                lines = f.readlines()
-                json_list = [json.loads(line.strip(
-                )) for line in lines if filter_func is None or filter_func(json.loads(line.strip()))]
-                return json_list
+                pass
+        json_list = [codec.loads(line) for line in content.splitlines() if line.strip()]
+        if filter_func is not None:
+            json_list = list(filter(filter_func, json_list))
+        return json_list
     else:
         return None
 
 
-def write_json_to_file(path: str, data: dict, is_json_line: bool = False) -> None:
+def _index_path(path):
+    return path + '.idx'
+
+
+def build_line_index(path, index_path=None):
+    """
+    为json_line文件建立行偏移索引（每个非空行起始位置的字节偏移），并保存为二进制文件
+    索引文件头部记录源文件的大小和修改时间，用于判断索引是否过期
+    :param path: json_line文件的绝对路径
+    :param index_path: 索引文件路径，默认为 path + '.idx'
+    :return: array('Q') 行偏移数组
+    """
+    offsets = array.array('Q')
+    stat = os.stat(path)
+    if stat.st_size > 0:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < stat.st_size:
+                end = mm.find(b'\n', start)
+                if end == -1:
+                    end = stat.st_size
+                # records start with '{' or '[', only other lines need the (copying) blank check
+                if end > start and (mm[start] in b'{[' or mm[start:end].strip()):
+                    offsets.append(start)
+                start = end + 1
+
+    with open(index_path or _index_path(path), 'wb') as f:
+        array.array('Q', [stat.st_size, stat.st_mtime_ns]).tofile(f)
+        offsets.tofile(f)
+    return offsets
+
+
+def load_line_index(path, index_path=None):
+    """
+    读取json_line文件的行偏移索引，索引不存在或已过期时重新建立
+    :param path: json_line文件的绝对路径
+    :param index_path: 索引文件路径，默认为 path + '.idx'
+    :return: array('Q') 行偏移数组
+    """
+    index_path = index_path or _index_path(path)
+    if os.path.exists(index_path):
+        stat = os.stat(path)
+        with open(index_path, 'rb') as f:
+            index = array.array('Q')
+            index.frombytes(f.read())
+        if len(index) >= 2 and index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+            return index[2:]
+    return build_line_index(path, index_path)
+
+
+def read_json_lines_by_index(path, indices, index_path=None, codec=None):
+    """
+    通过行偏移索引和mmap随机读取json_line文件中的若干条记录，只解析被读取的行
+    :param path: json_line文件的绝对路径
+    :param indices: 记录序号（从0开始）的列表或 numpy 数组，支持负数
+    :param index_path: 索引文件路径，默认为 path + '.idx'
+    :param codec: 解码使用的codec名称，见 utils.json_codec
+    :return: 与 indices 顺序一致的 json list
+    """
+    codec = get_codec(codec)
+    offsets = load_line_index(path, index_path)
+    records = []
+    # len() rather than truthiness: numpy index arrays (group_indices, flatnonzero) are common here
+    if len(indices) == 0:
+        return records
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for idx in indices:
+            start = offsets[idx]
+            end = mm.find(b'\n', start)
+            records.append(codec.loads(mm[start:end if end != -1 else len(mm)]))
+    return records
+
+
+def read_json_line_by_index(path, idx, index_path=None):
+    """
+    读取json_line文件中的第 idx 条记录
+    :param path: json_line文件的绝对路径
+    :param idx: 记录序号（从0开始）
+    :return: json对象
+    """
+    return read_json_lines_by_index(path, [idx], index_path)[0]
+
+
+def count_json_lines(path, index_path=None):
+    """
+    json_line文件中的记录数（来自行偏移索引）
+    """
+    return len(load_line_index(path, index_path))
+
+
+def sample_json_lines(path, k, seed=None, index_path=None):
+    """
+    从json_line文件中随机抽取 k 条记录（不放回）
+    :param path: json_line文件的绝对路径
+    :param k: 抽样数量，超过记录数时返回全部记录
+    :param seed: 随机种子
+    :return: (记录序号列表, json list)
+    """
+    n = count_json_lines(path, index_path)
+    indices = sorted(random.Random(seed).sample(range(n), min(k, n)))
+    return indices, read_json_lines_by_index(path, indices, index_path)
+
+
+def find_json_line_indices(path, needle, index_path=None):
+    """
+    查找包含指定字节串的记录序号，不解析json，例如 b'"Parse@1": false' 可找出所有解析失败的样本
+    :param path: json_line文件的绝对路径
+    :param needle: 要查找的字节串（需与写入时的json格式一致）
+    :return: 记录序号列表
+    """
+    offsets = load_line_index(path, index_path)
+    indices = []
+    if not offsets:
+        return indices
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(needle)
+        while pos != -1:
+            idx = bisect.bisect_right(offsets, pos) - 1
+            indices.append(idx)
+            # continue after the end of the matched line
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                break
+            pos = mm.find(needle, end + 1)
+    return indices
+
+
+def write_json_to_file(path: str, data: dict, is_json_line: bool = False, codec=None, atomic: bool = False) -> None:
     """
     将json写入文件
     :param path: json文件的绝对路径
     :param data: json数据
     :param is_json_line: 是否为json_line格式的文件，默认为False
+    :param codec: json_line编码使用的codec名称，默认与 json.dumps(ensure_ascii=False) 的输出逐字节一致
+    :param atomic: 先写入临时文件再替换，读者不会看到写了一半的文件，默认为False
     :return: None
     """
     valid_path(path)
-    with open(path, 'w', encoding='utf-8') as f:
+    write_path = path + '.tmp' if atomic else path
+    with open(write_path, 'w', encoding='utf-8') as f:
         if is_json_line:
-            for line in data:
-                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+            write_json_lines(f, data, get_codec(codec) if codec is not None else None)
         else:
             f.write(json.dumps(data, ensure_ascii=False, indent=4))
+    if atomic:
+        os.replace(write_path, path)
 
 
 def save_as_csv(path: str, data: list, sep: str = '\t'):
@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+"""
+json 编解码层：安装了 orjson 或 msgspec 时用它们解码，否则回退到标准库 json
+
+编码默认使用标准库（复用同一个 JSONEncoder，ensure_ascii=False），输出与
+json.dumps(obj, ensure_ascii=False) 逐字节一致；orjson / msgspec 输出紧凑格式（没有 ', ' 和 ': ' 中的空格），
+只有显式指定时才用于编码。
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# codec used when none is given, overridable with the JSON_CODEC environment variable
+DEFAULT_CODEC = os.environ.get('JSON_CODEC', 'auto')
+# records encoded per buffered write in write_json_lines
+WRITE_BATCH_SIZE = 1024
+
+
+class StdlibCodec:
+    name = 'json'
+
+    def __init__(self, ensure_ascii=False):
+        # json.dumps builds a new JSONEncoder on every call with non-default arguments
+        self._encoder = json.JSONEncoder(ensure_ascii=ensure_ascii)
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj) -> str:
+        return self._encoder.encode(obj)
+
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity written by the stdlib encoder
+            return json.loads(data)
+
+    def dumps(self, obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+
+class MsgspecCodec:
+    name = 'msgspec'
+
+    def __init__(self):
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError:
+            return json.loads(data)
+
+    def dumps(self, obj) -> str:
+        return self._encoder.encode(obj).decode('utf-8')
+
+
+CODECS = {
+    'json': (StdlibCodec, True),
+    'orjson': (OrjsonCodec, orjson is not None),
+    'msgspec': (MsgspecCodec, msgspec is not None),
+}
+_codec_cache = {}
+
+
+def available_codecs():
+    """已安装的 codec 名称，按速度从快到慢"""
+    return [name for name in ['orjson', 'msgspec', 'json'] if CODECS[name][1]]
+
+
+def get_codec(name=None):
+    """
+    获取 codec 实例
+    :param name: 'auto'（已安装中最快的）、'orjson'、'msgspec' 或 'json'，默认为 DEFAULT_CODEC
+    :return: 具有 loads / dumps 方法的 codec
+    """
+    name = name or DEFAULT_CODEC
+    if name == 'auto':
+        name = available_codecs()[0]
+    if name not in CODECS:
+        raise ValueError(f"Unexpected json codec: {name}")
+    codec_cls, installed = CODECS[name]
+    if not installed:
+        raise ImportError(f"json codec {name} is not installed")
+    if name not in _codec_cache:
+        _codec_cache[name] = codec_cls()
+    return _codec_cache[name]
+
+
+def write_json_lines(f, data, codec=None, batch_size=WRITE_BATCH_SIZE):
+    """
+    按 json_line 格式写入，每 batch_size 条记录拼接后一次写入
+    :param f: 以文本模式打开的文件对象
+    :param data: json 对象的可迭代对象
+    :param codec: 编码使用的 codec，默认为与 json.dumps(ensure_ascii=False) 逐字节一致的标准库编码
+    :return: None
+    """
+    dumps = (codec or get_codec('json')).dumps
+    batch = []
+    for item in data:
+        batch.append(dumps(item))
+        if len(batch) >= batch_size:
+            batch.append('')
+            f.write('\n'.join(batch))
+            batch = []
+    if batch:
+        batch.append('')
+        f.write('\n'.join(batch))
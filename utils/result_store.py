@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from utils.eval_util import EM_METRICS
+
+# group_type of the rows stored for one evaluated file, and the detailed results key they come from
+GROUP_TYPES = {
+    'complexity': 'by_complexity',
+    'reasoning': 'by_reasoning',
+    'combined': 'by_combined',
+}
+# summary views, named after the level column of the summary csvs
+SUMMARY_VIEWS = {
+    'complexity': 'layout_complexity',
+    'reasoning': 'reasoning_level',
+}
+KEY_COLUMNS = ['experiment', 'model_name', 'input_type', 'group_type', 'group_value']
+
+
+def result_rows(experiment, detailed_results):
+    """
+    将一个模型的 detailed results 展开为结果表的行（overall + 每个分组）
+    :param experiment: 实验名称
+    :param detailed_results: evaluate_model_results 的返回值
+    :return: list of dict
+    """
+    multi_sample = detailed_results.get('multi_sample', {})
+    sample_counts = detailed_results['sample_counts']
+
+    def make_row(group_type, group_value, sample_count, result, multi_sample_result):
+        return {
+            'experiment': experiment,
+            'model_name': detailed_results['model_name'],
+            'input_type': detailed_results['input_type'],
+            'group_type': group_type,
+            'group_value': group_value,
+            'sample_count': sample_count,
+            **{metric: result[metric] for metric in EM_METRICS},
+            'multi_sample': json.dumps(multi_sample_result) if multi_sample_result else None,
+        }
+
+    rows = [make_row('overall', 'Overall', sum(sample_counts['complexity'].values()),
+                     detailed_results['overall'], multi_sample.get('overall'))]
+    for group_type, key in GROUP_TYPES.items():
+        for level, result in detailed_results[key].items():
+            rows.append(make_row(group_type, level, sample_counts[group_type][level],
+                                 result, multi_sample.get(key, {}).get(level)))
+    return rows
+
+
+class ResultStore:
+    """
+    基于 SQLite 的实验结果库：每个 (experiment, model, input_type, 分组) 一行，评测完一个文件即增量 upsert，
+    汇总 csv 由视图查询生成，跨实验对比无需重新扫描 json 文件
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self):
+        metric_columns = ', '.join(f'{metric} REAL' for metric in EM_METRICS)
+        statements = [
+            f'''CREATE TABLE IF NOT EXISTS results (
+                experiment TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                input_type TEXT NOT NULL,
+                group_type TEXT NOT NULL,
+                group_value TEXT NOT NULL,
+                sample_count INTEGER NOT NULL,
+                {metric_columns},
+                multi_sample TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY ({', '.join(KEY_COLUMNS)})
+            )''',
+            'CREATE INDEX IF NOT EXISTS idx_results_model ON results (model_name, input_type)',
+            'CREATE INDEX IF NOT EXISTS idx_results_group ON results (group_type, group_value)',
+            'CREATE INDEX IF NOT EXISTS idx_results_input_type ON results (input_type)',
+        ]
+        for group_type, level_column in SUMMARY_VIEWS.items():
+            statements.append(f'''CREATE VIEW IF NOT EXISTS {group_type}_summary AS
+                SELECT experiment, model_name, input_type, group_value AS {level_column}, sample_count,
+                       {', '.join(EM_METRICS)}
+                FROM results WHERE group_type IN ('overall', '{group_type}')''')
+        with self.conn:
+            for statement in statements:
+                self.conn.execute(statement)
+
+    def upsert_results(self, experiment, detailed_results):
+        """
+        写入（或覆盖）一个模型在一种输入类型上的全部分组结果
+        旧结果中已不存在的分组会被删除
+        """
+        rows = result_rows(experiment, detailed_results)
+        columns = list(rows[0].keys()) + ['updated_at']
+        updated_at = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.execute('DELETE FROM results WHERE experiment = ? AND model_name = ? AND input_type = ?',
+                              (experiment, detailed_results['model_name'], detailed_results['input_type']))
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [tuple(row.values()) + (updated_at,) for row in rows])
+
+    def query(self, **filters):
+        """
+        按 experiment / model_name / input_type / group_type / group_value 查询结果行
+        :param filters: 列名=值，值为 list/tuple 时匹配其中任意一个
+        :return: list of dict
+        """
+        conditions, params = [], []
+        for column, value in filters.items():
+            if column not in KEY_COLUMNS:
+                raise ValueError(f'Unexpected filter: {column}')
+            if isinstance(value, (list, tuple)):
+                conditions.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        sql = 'SELECT * FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f" ORDER BY {', '.join(KEY_COLUMNS)}"
+        rows = [dict(row) for row in self.conn.execute(sql, params)]
+        for row in rows:
+            if row['multi_sample'] is not None:
+                row['multi_sample'] = json.loads(row['multi_sample'])
+        return rows
+
+    def summary(self, experiment, by='complexity', keys=None):
+        """
+        汇总视图中一个实验的行，列与汇总 csv 一致
+        :param by: 'complexity' 或 'reasoning'
+        :param keys: 只保留这些 (model_name, input_type)，通常为本次评测的文件；None 表示全部
+        :return: list of dict
+        """
+        level_column = SUMMARY_VIEWS[by]
+        sql = f'''SELECT model_name, input_type, {level_column}, sample_count, {', '.join(EM_METRICS)}
+                  FROM {by}_summary WHERE experiment = ?
+                  ORDER BY model_name, input_type, {level_column}'''
+        rows = [dict(row) for row in self.conn.execute(sql, (experiment,))]
+        if keys is not None:
+            keys = {tuple(key) for key in keys}
+            rows = [row for row in rows if (row['model_name'], row['input_type']) in keys]
+        return rows
+
+    def close(self):
+        self.conn.close()
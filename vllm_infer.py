@@ -1,24 +1,32 @@
-import vllm
 import argparse
 import os 
 import json 
-import utils
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import transformers
-import torch
-from pprint import pprint
+import time
+import functools
+import contextlib
+import importlib
+from types import SimpleNamespace
+from data_parallel import ReplicaPool
+from openai_client import OpenAIEngine
+from utils.json_codec import get_codec
+from utils.exp_util import add_experiment_args, parse_experiment_args, inference_file_name
+
+try:
+    import vllm
+except ImportError:  # only the vllm backend needs it, the openai backend runs on a CPU box
+    vllm = None
 
 
 def load_data(args, filename):
 
 
-    lines = open(os.path.join(args.data_path, filename), encoding='utf-8').readlines()
-    lines = [json.loads(x) for x in lines if x.strip()]
+    lines = open(os.path.join(args.data_path, filename), 'rb').readlines()
+    loads = get_codec().loads
+    lines = [loads(x) for x in lines if x.strip()]
     list_data_dict =  lines 
     
     if 'qwen' in args.base_model.lower() or 'qw2' in args.base_model.lower():
         prompts = []
-        tokenizer = AutoTokenizer.from_pretrained(args.base_model)
         # list_data_dict = list_data_dict[:10]
         for example in list_data_dict:
         
@@ -32,7 +40,6 @@ def load_data(args, filename):
 
     elif 'llama-3' in args.base_model.lower() or 'dpsk' in args.base_model.lower():
         prompts = []
-        tokenizer = AutoTokenizer.from_pretrained(args.base_model)
 
         for example in list_data_dict:
 
@@ -43,50 +50,331 @@ def load_data(args, filename):
     assert len(prompts) == len(list_data_dict)
     return prompts, list_data_dict
 
-def run(args):
 
-    sampling_params = vllm.SamplingParams(n = args.sample_n, temperature=args.temperature, top_p=0.95, max_tokens=8000)
+def truncate_prompt_ids(token_ids, budget):
+    """Keep the head and the tail of an over-length prompt.
 
-    print("args:", args)
-    model = vllm.LLM(model=args.base_model, tensor_parallel_size=2, trust_remote_code=True)
+    The head holds the chat template and the start of the instruction, the tail holds
+    the question and the assistant tag, so the middle (usually table content) is dropped.
+    """
+    head = budget // 2
+    tail = budget - head
+    return token_ids[:head] + (token_ids[-tail:] if tail > 0 else [])
 
-    fnames = [x for x in os.listdir(args.data_path) if x.endswith('.jsonl')]
-    for filename in fnames:
-        print(filename)
-        prompts, raw_datas = load_data(args, filename)
-        print(args.temperature)
 
-        outputs = model.generate(prompts, sampling_params)
+def truncate_prompt(tokenizer, prompt, length, prompt_budget):
+    """
+    Truncate a prompt to at most prompt_budget tokens as the engine will count them.
+    decode -> encode is not length-stable for many tokenizers, so the truncated prompt is
+    measured again and the budget shrunk until it fits.
+    :return: (truncated prompt, its measured length in tokens)
+    """
+    token_ids = tokenizer(prompt, add_special_tokens=False)['input_ids']
+    # leave room for the special tokens the engine adds back when re-encoding
+    budget = prompt_budget - (length - len(token_ids))
+    while True:
+        truncated = tokenizer.decode(truncate_prompt_ids(token_ids, max(budget, 0)))
+        truncated_length = len(tokenizer(truncated)['input_ids'])
+        if truncated_length <= prompt_budget or budget <= 0:
+            return truncated, truncated_length
+        budget -= truncated_length - prompt_budget
 
-        assert len(outputs) == len(raw_datas)
-        
-        for idx, output in enumerate(outputs):
-            prompt = output.prompt
-            generated_texts = [item.text for item in output.outputs ]
 
-            raw_datas[idx]["raw_generation"] = generated_texts
+def summarize_lengths(lengths):
+    """Length distribution of the measured prompts (min/max/mean and percentiles)."""
+    if not lengths:
+        return {}
+    ordered = sorted(lengths)
 
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
 
-        save_path = os.path.join(args.outdir, args.base_model.split('/')[-1]+'_'+filename.split('.')[0]+'.jsonl')
+    return {
+        'count': len(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': round(sum(ordered) / len(ordered), 2),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+    }
 
-        with open(save_path, 'w') as f:
-            for item in raw_datas:
-                f.write(json.dumps(item)+'\n')
 
+def admit_prompts(args, tokenizer, prompts):
+    """
+    Measure every prompt on the CPU before generation and size its generation budget.
+
+    Prompts whose remaining context (model_max_length - prompt length) is below
+    args.min_new_tokens are overflows: with overflow_policy 'skip' they are rejected,
+    with 'truncate' they are shortened to leave exactly min_new_tokens of room.
+    :return: (admitted indices, admitted prompts, max_tokens per admitted prompt, report)
+    """
+    lengths = [len(ids) for ids in tokenizer(prompts)['input_ids']]
+    prompt_budget = args.model_max_length - args.min_new_tokens
+
+    admitted_idx, admitted_prompts, max_tokens, rejects = [], [], [], []
+    for idx, (prompt, length) in enumerate(zip(prompts, lengths)):
+        if length > prompt_budget:
+            rejects.append({'index': idx, 'prompt_tokens': length, 'action': args.overflow_policy})
+            if args.overflow_policy == 'skip':
+                continue
+            prompt, length = truncate_prompt(tokenizer, prompt, length, prompt_budget)
+            rejects[-1]['truncated_tokens'] = length
+            if length > prompt_budget:
+                # the tokenizer could not produce a short enough prompt
+                rejects[-1]['action'] = 'skip'
+                continue
+        admitted_idx.append(idx)
+        admitted_prompts.append(prompt)
+        max_tokens.append(min(args.max_new_tokens, args.model_max_length - length))
+
+    report = {
+        'model_max_length': args.model_max_length,
+        'max_new_tokens': args.max_new_tokens,
+        'min_new_tokens': args.min_new_tokens,
+        'overflow_policy': args.overflow_policy,
+        'num_prompts': len(prompts),
+        'num_admitted': len(admitted_idx),
+        'num_overflow': len(rejects),
+        'prompt_tokens': summarize_lengths(lengths),
+        'max_tokens': summarize_lengths(max_tokens),
+        'overflow': rejects,
+    }
+    return admitted_idx, admitted_prompts, max_tokens, report
+
+
+def request_metrics(output):
+    """Token counters of one RequestOutput (works on any object with the same attributes)."""
+    completions = output.outputs
+    usage = getattr(output, 'usage', None)
+    if usage is not None:
+        # http backends report totals only: the generated tokens of all n completions in one count
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        generated_tokens = [usage.get('completion_tokens', 0)]
+    else:
+        # servers may omit usage too, the counts are then 0
+        prompt_tokens = len(output.prompt_token_ids or [])
+        generated_tokens = [len(item.token_ids or []) for item in completions]
+    return {
+        'request_id': getattr(output, 'request_id', None),
+        'prompt_tokens': prompt_tokens,
+        'generated_tokens': generated_tokens,
+        'finish_reasons': [item.finish_reason for item in completions],
+        'error': getattr(output, 'error', None),
+    }
+
+
+def sampling_settings(args):
+    """Sampling and parallelism settings recorded alongside the throughput numbers."""
+    return {
+        'base_model': args.base_model,
+        'backend': args.backend,
+        'sample_n': args.sample_n,
+        'temperature': args.temperature,
+        'top_p': 0.95,
+        'max_new_tokens': args.max_new_tokens,
+        'model_max_length': args.model_max_length,
+        'tensor_parallel_size': args.tensor_parallel_size,
+        'data_parallel_size': args.data_parallel_size,
+    }
+
+
+def build_file_metrics(filename, outputs, wall_time, settings):
+    """
+    Aggregate per-request counters of one input file into a metrics sidecar.
+    :param outputs: RequestOutput list returned by LLM.generate
+    :param wall_time: seconds spent in LLM.generate for this file
+    """
+    requests = [request_metrics(output) for output in outputs]
+    prompt_tokens = sum(x['prompt_tokens'] for x in requests)
+    generated_tokens = sum(sum(x['generated_tokens']) for x in requests)
+    finish_reasons = {}
+    for x in requests:
+        for reason in x['finish_reasons']:
+            finish_reasons[str(reason)] = finish_reasons.get(str(reason), 0) + 1
+
+    return {
+        'filename': filename,
+        'settings': settings,
+        'num_requests': len(requests),
+        'num_failed': sum(1 for x in requests if x['error']),
+        'prompt_tokens': prompt_tokens,
+        'generated_tokens': generated_tokens,
+        'finish_reasons': finish_reasons,
+        'wall_time': round(wall_time, 3),
+        'requests_per_sec': round(len(requests) / wall_time, 3) if wall_time > 0 else None,
+        'generated_tokens_per_sec': round(generated_tokens / wall_time, 3) if wall_time > 0 else None,
+        'total_tokens_per_sec': round((prompt_tokens + generated_tokens) / wall_time, 3) if wall_time > 0 else None,
+        'requests': requests,
+    }
+
+
+def make_engine(engine_cls, base_model, tensor_parallel_size, model_max_length):
+    """
+    Build one engine; module level so the data-parallel workers can unpickle it.
+    :param engine_cls: dotted path of the engine class, vllm.LLM or a stub with the same generate()
+    """
+    module_name, cls_name = engine_cls.rsplit('.', 1)
+    cls = getattr(importlib.import_module(module_name), cls_name)
+    return cls(model=base_model, tensor_parallel_size=tensor_parallel_size, trust_remote_code=True,
+               max_model_len=model_max_length)
+
+
+def build_engine(args):
+    # imported here: the module itself loads without transformers or torch (CPU box, stub engines)
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model, trust_remote_code=True)
+    if args.backend == 'openai':
+        # the tokenizer still runs locally for admission, generation goes to the server
+        model = OpenAIEngine(args.api_base, args.api_model or args.base_model, api_key=args.api_key,
+                             max_concurrency=args.max_concurrency, max_retries=args.max_retries,
+                             timeout=args.request_timeout)
+        return tokenizer, model
+    engine_factory = functools.partial(make_engine, args.engine_cls, args.base_model,
+                                       args.tensor_parallel_size, args.model_max_length)
+    if args.data_parallel_size > 1:
+        # one replica per tensor_parallel_size GPUs, all sharing the prompts of each file
+        model = ReplicaPool(engine_factory, args.data_parallel_size, args.tensor_parallel_size,
+                            chunk_size=args.dp_chunk_size)
+    else:
+        model = engine_factory()
+    return tokenizer, model
+
+
+def engine_context(model):
+    """Context that stops the replica workers on exit (terminating them on an error); a no-op for other engines."""
+    return model if isinstance(model, ReplicaPool) else contextlib.nullcontext(model)
+
+
+def make_sampling_params(args, max_tokens):
+    """
+    One set of sampling parameters per prompt, in the form the backend takes: dicts for the
+    openai backend, vllm.SamplingParams, or objects with the same fields when vllm is not
+    installed (stub engines on a CPU box)
+    """
+    params = [{'n': args.sample_n, 'temperature': args.temperature, 'top_p': 0.95, 'max_tokens': budget}
+              for budget in max_tokens]
+    if args.backend == 'openai':
+        return params
+    params_cls = vllm.SamplingParams if vllm is not None else SimpleNamespace
+    return [params_cls(**x) for x in params]
 
-if __name__ == '__main__': 
 
-    parser = argparse.ArgumentParser(description='Parameters')
+def generate_file(args, model, tokenizer, filename):
+    """
+    Run admission and generation for one input file.
+    :return: (all records with raw_generation, admission report, metrics sidecar); skipped
+        over-length prompts get empty generations and prompt_skipped, so they are scored as misses
+    """
+    prompts, raw_datas = load_data(args, filename)
+    print(args.temperature)
 
+    admitted_idx, prompts, max_tokens, report = admit_prompts(args, tokenizer, prompts)
+    print(f"admitted {report['num_admitted']}/{report['num_prompts']} prompts, "
+          f"{report['num_overflow']} over length ({args.overflow_policy})")
+
+    # one SamplingParams per prompt so short prompts do not reserve the full budget
+    sampling_params = make_sampling_params(args, max_tokens)
+    start = time.perf_counter()
+    outputs = model.generate(prompts, sampling_params)
+    wall_time = time.perf_counter() - start
+
+    assert len(outputs) == len(admitted_idx)
+    truncated_idx = {x['index'] for x in report['overflow'] if x['action'] == 'truncate'}
+    admitted = set(admitted_idx) if len(admitted_idx) < len(raw_datas) else None
+
+    for idx, output in zip(admitted_idx, outputs):
+        generated_texts = [item.text for item in output.outputs]
+
+        if getattr(output, 'error', None):
+            # a request that failed for good (openai backend) is kept and scored as a miss
+            generated_texts = [''] * args.sample_n
+            raw_datas[idx]["generation_error"] = output.error
+        raw_datas[idx]["raw_generation"] = generated_texts
+        if truncated_idx:
+            raw_datas[idx]["prompt_truncated"] = idx in truncated_idx
+
+    results = []
+    for idx, item in enumerate(raw_datas):
+        if admitted is not None:
+            item["prompt_skipped"] = idx not in admitted
+            if item["prompt_skipped"]:
+                # sample_n empty generations keep the multi-sample width of the file
+                item["raw_generation"] = [''] * args.sample_n
+        results.append(item)
+
+    metrics = build_file_metrics(filename, outputs, wall_time, sampling_settings(args))
+    print(f"{metrics['num_requests']} requests ({metrics['num_failed']} failed), {metrics['prompt_tokens']} prompt tokens, "
+          f"{metrics['generated_tokens']} generated tokens in {metrics['wall_time']}s "
+          f"({metrics['generated_tokens_per_sec']} tok/s)")
+    return results, report, metrics
+
+
+def get_save_path(args, filename):
+    """<inference_dir>/<model>=<file>.jsonl, where the parse / eval scripts and the pipeline look for it"""
+    return os.path.join(args.outdir or args.inference_dir, inference_file_name(args.base_model, filename))
+
+
+def save_file(save_path, results, report, metrics):
+    """Write the generations and their admission / metrics sidecars."""
+    with open(save_path, 'w') as f:
+        for item in results:
+            f.write(json.dumps(item)+'\n')
+
+    with open(save_path[:-len('.jsonl')] + '.admission.json', 'w') as f:
+        json.dump(report, f, indent=4)
+
+    with open(save_path[:-len('.jsonl')] + '.metrics.json', 'w') as f:
+        json.dump(metrics, f, indent=4)
+
+
+def run(args):
+
+    print("args:", args)
+    tokenizer, model = build_engine(args)
+
+    fnames = [x for x in os.listdir(args.data_path) if x.endswith('.jsonl')]
+    os.makedirs(args.outdir or args.inference_dir, exist_ok=True)
+    with engine_context(model):
+        for filename in fnames:
+            print(filename)
+            results, report, metrics = generate_file(args, model, tokenizer, filename)
+            save_file(get_save_path(args, filename), results, report, metrics)
+
+
+def add_infer_args(parser):
     parser.add_argument("--base_model", default="", type=str, help="model path")
     parser.add_argument("--data_path", default="", type=str, help="config path")
     parser.add_argument("--temperature", default=0.0, type=float, help="config path")
     parser.add_argument("--task", default="complete", type=str, help="config path")
-    parser.add_argument("--outdir", default="outputs_size", type=str, help="config path")
+    parser.add_argument("--outdir", default=None, type=str, help="output directory, defaults to --inference_dir")
     parser.add_argument("--do_sample", default=False, type=bool, help="config path")
-    parser.add_argument("--model_max_length", type=int, default=8000, help="beam size")
+    parser.add_argument("--model_max_length", type=int, default=8000, help="context window (prompt + generation) in tokens")
+    parser.add_argument("--max_new_tokens", type=int, default=8000, help="upper bound of generated tokens per prompt")
+    parser.add_argument("--min_new_tokens", type=int, default=16, help="prompts leaving less generation room than this overflow")
+    parser.add_argument("--overflow_policy", default="skip", choices=["skip", "truncate"], help="what to do with over-length prompts")
+    parser.add_argument("--tensor_parallel_size", type=int, default=2, help="GPUs per engine")
+    parser.add_argument("--data_parallel_size", type=int, default=1, help="engine replicas, each on its own tensor_parallel_size GPUs")
+    parser.add_argument("--dp_chunk_size", type=int, default=64, help="prompts per task handed to a replica")
+    parser.add_argument("--engine_cls", default="vllm.LLM", type=str, help="engine class (dotted path), e.g. a CPU stub with the generate() of vllm.LLM")
+    parser.add_argument("--backend", default="vllm", choices=["vllm", "openai"], help="in-process vllm engine or an OpenAI-compatible server")
+    parser.add_argument("--api_base", default="http://localhost:8000/v1", type=str, help="OpenAI-compatible endpoint root")
+    parser.add_argument("--api_model", default="", type=str, help="model name on the server, defaults to base_model")
+    parser.add_argument("--api_key", default=os.environ.get('OPENAI_API_KEY'), type=str, help="bearer token of the server")
+    parser.add_argument("--max_concurrency", type=int, default=64, help="requests in flight to the server")
+    parser.add_argument("--max_retries", type=int, default=5, help="retries of a failed request")
+    parser.add_argument("--request_timeout", type=float, default=600, help="seconds per request")
     parser.add_argument("--sample_n", type=int, default=1, help="beam size")
+    return parser
+
+
+if __name__ == '__main__': 
+
+    # experiment args give the inference_dir shared with the parse / eval scripts and the pipeline
+    parser = add_experiment_args(argparse.ArgumentParser(description='Parameters'))
+    add_infer_args(parser)
 
-    args = parser.parse_args()
+    args = parse_experiment_args(parser)
 
-    run(args)
\ No newline at end of file
+    run(args)
@@ -0,0 +1,139 @@
+import argparse
+import os
+import time
+from utils.file_util import read_json_file, write_json_to_file
+from utils.exp_util import add_experiment_args, parse_experiment_args
+from utils.eval_util import evaluate_model_results, save_summary_csvs
+from utils.result_store import ResultStore
+from utils.eval_record import EvalRecords
+from batch_parse_response_script import parse_inference_results, prepare_inference_results
+from metrics.qa_metrics import QAMetric
+from metrics.multi_sample_metrics import MultiSampleQAMetric
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# Long-running parse + eval of an experiment whose inference results keep arriving.
+# Only new or changed .jsonl files (by mtime and size) are parsed and scored; the results
+# store is upserted per file and the summary csvs are refreshed atomically after each round.
+
+
+def scan_dir(folder_path, ext='.jsonl'):
+    """{file name: (mtime_ns, size)} of the files with the given extension."""
+    signatures = {}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.name.endswith(ext):
+                    stat = entry.stat()
+                    signatures[entry.name] = [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                continue  # removed (or renamed) between scandir and stat
+    return signatures
+
+
+def process_file(args, file_name, qa_metric, multi_sample_metric, result_store):
+    """
+    Parse one inference file, write the parsed results and the detailed evaluation, upsert the store.
+    :return: [model_name, input_type] of the stored results
+    """
+    print(f'Parsing {file_name}')
+    model_name = file_name.split('=')[0]
+    inference_results = read_json_file(os.path.join(args.inference_dir, file_name))
+    parsed_results = parse_inference_results(prepare_inference_results(inference_results, model_name))
+    write_json_to_file(os.path.join(args.parsed_dir, file_name), parsed_results, is_json_line=True, atomic=True)
+
+    detailed_results = evaluate_model_results(
+        EvalRecords.from_samples(parsed_results, model_name), qa_metric, multi_sample_metric)
+    json_output_file = os.path.join(
+        args.eval_dir, f"{model_name}_{detailed_results['input_type']}_complexity_evaluation.json")
+    write_json_to_file(json_output_file, detailed_results, atomic=True)
+    result_store.upsert_results(args.experiment_name, detailed_results)
+    return [model_name, detailed_results['input_type']]
+
+
+def wait_for_changes(inotify, interval):
+    """Block until the inference directory changes (inotify) or for one polling interval."""
+    if inotify is not None:
+        inotify.read(timeout=int(interval * 1000))
+    else:
+        time.sleep(interval)
+
+
+def watch(args):
+    os.makedirs(args.eval_dir, exist_ok=True)
+    # the daemon may start before the sweep has written anything
+    os.makedirs(args.inference_dir, exist_ok=True)
+    qa_metric = QAMetric(cache_scores=args.dedup_scores)
+    multi_sample_metric = MultiSampleQAMetric()
+    result_store = ResultStore(args.results_db)
+
+    # {file name: {'signature': ..., 'key': [model_name, input_type]}} of the files already evaluated,
+    # kept across restarts; entries of an older state format are evaluated again
+    state_file = os.path.join(args.eval_dir, 'watch_state.json')
+    state = {name: entry for name, entry in (read_json_file(state_file) or {}).items() if isinstance(entry, dict)}
+
+    inotify = None
+    if INotify is not None and not args.once and not args.poll:
+        inotify = INotify()
+        inotify.add_watch(args.inference_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        print(f'Watching {args.inference_dir} with inotify')
+    else:
+        print(f'Watching {args.inference_dir} every {args.interval}s')
+
+    # a changed file is processed once its signature has stayed the same for settle_time seconds,
+    # so files still being written by an inference job are not picked up half-way; with inotify
+    # two scans can be milliseconds apart, so matching signatures alone are not enough
+    candidates = {}  # {file name: (signature, monotonic time it was first seen)}
+    while True:
+        current = scan_dir(args.inference_dir)
+        now = time.monotonic()
+        changed = {name: sig for name, sig in current.items() if state.get(name, {}).get('signature') != sig}
+        removed = [name for name in state if name not in current]
+        for file_name in removed:
+            del state[file_name]
+        candidates = {name: candidates[name] if candidates.get(name, (None,))[0] == sig else (sig, now)
+                      for name, sig in changed.items()}
+        ready = [name for name, (sig, since) in candidates.items() if args.once or now - since >= args.settle_time]
+
+        for file_name in sorted(ready):
+            key = None
+            try:
+                key = process_file(args, file_name, qa_metric, multi_sample_metric, result_store)
+            except Exception as e:
+                # a broken file must not stop the sweep; it is retried when it changes again
+                print(f'Failed to evaluate {file_name}: {e}')
+            state[file_name] = {'signature': current[file_name], 'key': key}
+            candidates.pop(file_name, None)
+
+        if ready or removed:
+            # the summaries cover the files currently in the inference directory only
+            keys = [entry['key'] for entry in state.values() if entry['key']]
+            for by in ('complexity', 'reasoning'):
+                save_summary_csvs(args.eval_dir, result_store.summary(args.experiment_name, by=by, keys=keys), by=by)
+            write_json_to_file(state_file, state, atomic=True)
+            print(f'Evaluated {len(ready)} new or changed files, {len(removed)} removed, {len(state)} in total')
+
+        if args.once:
+            break
+        # wake up when the next pending file has settled, even without further events
+        timeout = min([args.interval] + [since + args.settle_time - now for _, since in candidates.values()])
+        wait_for_changes(inotify, max(timeout, 0.1))
+    result_store.close()
+
+
+if __name__ == '__main__':
+    parser = add_experiment_args(argparse.ArgumentParser(description='Parse and evaluate inference results as they arrive'))
+    parser.add_argument("--interval", default=60, type=float, help="seconds between two scans of the inference results")
+    parser.add_argument("--settle_time", default=10, type=float,
+                        help="seconds a file's mtime and size must stay unchanged before it is processed")
+    parser.add_argument("--poll", action="store_true", help="poll mtime / size even when inotify_simple is installed")
+    parser.add_argument("--once", action="store_true", help="process the new or changed files once and exit")
+    parser.add_argument("--dedup_scores", action="store_true",
+                        help="score each distinct normalized (reference, prediction) pair once; the cache lives as "
+                             "long as the watcher, so it grows with the distinct pairs seen")
+    args = parse_experiment_args(parser)
+
+    watch(args)